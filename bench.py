@@ -0,0 +1,132 @@
+import os
+import resource
+import tempfile
+import time
+from datetime import datetime, UTC
+from pathlib import Path
+from types import SimpleNamespace
+
+from elasticsearch import helpers
+from elasticsearch.serializer import JSONSerializer
+
+from utils import setup_logging
+from build import finalize_blocks, build_chunks, build_manifest, parse_split_response, stream_split_batches
+from scan import scan_hashes
+
+logger = setup_logging(Path(__file__).stem)
+
+BENCH_FILES = int(os.getenv("BENCH_FILES", "200"))
+BENCH_LINES = int(os.getenv("BENCH_LINES", "300"))
+BENCH_BLOCKS = int(os.getenv("BENCH_BLOCKS", "8"))
+BENCH_SPLIT_LATENCY_MS = float(os.getenv("BENCH_SPLIT_LATENCY_MS", "0"))
+BENCH_SPLIT_MODE = os.getenv("BENCH_SPLIT_MODE", "sync")
+
+SERIALIZER = JSONSerializer()
+
+def write_synthetic_repo(root, files_count, lines_count):
+    for file_idx in range(files_count):
+        path = root / f"module_{file_idx % 10}" / f"file_{file_idx}.py"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        lines = [f"def function_{file_idx}_{line_idx}(value): return value * {line_idx}" for line_idx in range(lines_count)]
+        path.write_text("\n".join(lines), encoding="utf-8")
+
+def stub_split_blocks(total_lines, blocks_count, latency_ms):
+    time.sleep(latency_ms / 1000)
+    step = max(1, total_lines // blocks_count)
+    starts = list(range(1, total_lines + 1, step))[:blocks_count]
+    ends = [start - 1 for start in starts[1:]] + [total_lines]
+    return [
+        {"start_line": start, "end_line": end, "title": f"block: {idx}", "kind": "logic_block", "symbols": [f"block_{idx}"]}
+        for idx, (start, end) in enumerate(zip(starts, ends), start=1)
+    ]
+
+class StubBatches:
+    def __init__(self, blocks_count, latency_ms):
+        self.blocks_count = blocks_count
+        self.latency_ms = latency_ms
+        self.requests_by_batch = {}
+
+    def create(self, requests):
+        batch_id = f"stub-batch-{len(self.requests_by_batch)}"
+        self.requests_by_batch[batch_id] = requests
+        return SimpleNamespace(id=batch_id)
+
+    def retrieve(self, batch_id):
+        return SimpleNamespace(id=batch_id, processing_status="ended")
+
+    def results(self, batch_id):
+        time.sleep(self.latency_ms / 1000)
+        for request in self.requests_by_batch.pop(batch_id):
+            file_text = request["params"]["messages"][0]["content"][0]["text"]
+            blocks = stub_split_blocks(file_text.count("\n") + 1, self.blocks_count, 0)
+            message = SimpleNamespace(content=[SimpleNamespace(type="tool_use", input={"blocks": blocks})])
+            yield SimpleNamespace(custom_id=request["custom_id"], result=SimpleNamespace(type="succeeded", message=message))
+
+def split_results(root, rel_paths):
+    if BENCH_SPLIT_MODE == "batch":
+        for rel_path, result in stream_split_batches(StubBatches(BENCH_BLOCKS, BENCH_SPLIT_LATENCY_MS), root, rel_paths):
+            yield rel_path, parse_split_response(rel_path, result.message)
+        return
+    for rel_path in rel_paths:
+        lines = (root / rel_path).read_text(encoding="utf-8").count("\n") + 1
+        yield rel_path, stub_split_blocks(lines, BENCH_BLOCKS, BENCH_SPLIT_LATENCY_MS)
+
+def serialize_bulk(actions):
+    payload_bytes = 0
+    for action in actions:
+        header, data = helpers.expand_action(action)
+        payload_bytes += len(SERIALIZER.dumps(header)) + len(SERIALIZER.dumps(data)) + 2
+    return payload_bytes
+
+def run_benchmark(root, cache_file):
+    timings = {"scan": 0.0, "rescan": 0.0, "split": 0.0, "normalize": 0.0, "embed": 0.0, "serialize": 0.0}
+    t0 = time.perf_counter()
+    hash_by_file = scan_hashes(root, cache_file, {}, [])
+    timings["scan"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    scan_hashes(root, cache_file, {}, [])
+    timings["rescan"] = time.perf_counter() - t0
+    chunks_count = 0
+    payload_bytes = 0
+    now_iso = datetime.now(UTC).isoformat()
+    results = split_results(root, list(hash_by_file))
+    while True:
+        t0 = time.perf_counter()
+        split_result = next(results, None)
+        timings["split"] += time.perf_counter() - t0
+        if split_result is None:
+            break
+        rel_path, blocks = split_result
+        file_hash = hash_by_file[rel_path]
+        full_path = root / rel_path
+        file_text = full_path.read_text(encoding="utf-8")
+        t0 = time.perf_counter()
+        blocks = finalize_blocks(rel_path, file_text, blocks)
+        timings["normalize"] += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        chunks = build_chunks(rel_path, file_hash, full_path, file_text, blocks, now_iso)
+        timings["embed"] += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        payload_bytes += serialize_bulk(chunks + [build_manifest(rel_path, file_hash, now_iso)])
+        timings["serialize"] += time.perf_counter() - t0
+        chunks_count += len(chunks)
+    return len(hash_by_file), chunks_count, payload_bytes, timings
+
+def main():
+    logger.info(f"🏁 Benchmark: files={BENCH_FILES}, lines={BENCH_LINES}, blocks={BENCH_BLOCKS}, "
+                f"split_mode={BENCH_SPLIT_MODE}, split_latency={BENCH_SPLIT_LATENCY_MS}ms")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = Path(tmp_dir) / "repo"
+        write_synthetic_repo(root, BENCH_FILES, BENCH_LINES)
+        t0 = time.perf_counter()
+        files_count, chunks_count, payload_bytes, timings = run_benchmark(root, Path(tmp_dir) / "scan_stat.json")
+        total_seconds = time.perf_counter() - t0
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    for stage, seconds in timings.items():
+        logger.info(f"⏱️  {stage}: {seconds:.2f}s ({seconds / total_seconds * 100:.1f}%)")
+    logger.info(f"📦 Bulk payload: {payload_bytes / 1024 / 1024:.1f} MB")
+    logger.info(f"🚀 {files_count / total_seconds:.1f} files/s, {chunks_count / total_seconds:.1f} chunks/s in {total_seconds:.2f}s")
+    logger.info(f"🧠 Peak RSS: {peak_rss_mb:.1f} MB")
+
+if __name__ == "__main__":
+    main()
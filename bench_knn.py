@@ -0,0 +1,136 @@
+import itertools
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+from elasticsearch import Elasticsearch, helpers
+from elasticsearch.serializer import JSONSerializer
+
+from utils import (
+    ES_URL, ES_INDEX_CHUNKS, EMBED_DIMS, EMBED_VECTOR_DECIMALS, VECTOR_INDEX_TYPE, VECTOR_HNSW_M,
+    VECTOR_HNSW_EF_CONSTRUCTION, KNN_NUM_CANDIDATES_FACTOR, setup_logging
+)
+
+logger = setup_logging(Path(__file__).stem)
+
+BENCH_KNN_SOURCE = os.getenv("BENCH_KNN_SOURCE", "chunks")
+BENCH_KNN_DOCS = int(os.getenv("BENCH_KNN_DOCS", "20000"))
+BENCH_KNN_QUERIES = int(os.getenv("BENCH_KNN_QUERIES", "200"))
+BENCH_KNN_K = int(os.getenv("BENCH_KNN_K", "32"))
+BENCH_KNN_WARMUP = 10
+BENCH_RANDOM_DIMS = 1024
+KNN_MAX_NUM_CANDIDATES = 10000
+
+BYTES_PER_DIM = {"hnsw": 4, "int8_hnsw": 1}
+EXTRA_BYTES_PER_VECTOR = {"hnsw": 0, "int8_hnsw": 4}
+
+ES = Elasticsearch(ES_URL, request_timeout=300)
+SERIALIZER = JSONSerializer()
+
+VARIANTS = [
+    {"name": "baseline", "type": "hnsw", "m": 32, "ef_construction": 256, "dims": 1024, "decimals": None, "num_candidates_factor": 4},
+    {
+        "name": "candidate", "type": VECTOR_INDEX_TYPE, "m": VECTOR_HNSW_M, "ef_construction": VECTOR_HNSW_EF_CONSTRUCTION,
+        "dims": EMBED_DIMS, "decimals": EMBED_VECTOR_DECIMALS, "num_candidates_factor": KNN_NUM_CANDIDATES_FACTOR,
+    },
+]
+
+def load_vectors(count):
+    if BENCH_KNN_SOURCE == "random":
+        vectors = np.random.default_rng(0).standard_normal((count, BENCH_RANDOM_DIMS), dtype=np.float32)
+    else:
+        hits = helpers.scan(ES, index=ES_INDEX_CHUNKS, query={"_source": ["embedding"]}, size=1000)
+        vectors = np.array([hit["_source"]["embedding"] for hit in itertools.islice(hits, count)], dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def variant_vector(variant, vector):
+    truncated = vector[:variant["dims"]]
+    if variant["decimals"] is None:
+        return truncated.tolist()
+    return np.round(truncated, variant["decimals"]).tolist()
+
+def create_index(index_name, variant):
+    ES.indices.delete(index=index_name, ignore_unavailable=True)
+    ES.indices.create(
+        index=index_name,
+        settings={"number_of_shards": 1, "number_of_replicas": 0, "refresh_interval": "-1"},
+        mappings={"properties": {"embedding": {
+            "type": "dense_vector", "dims": variant["dims"], "index": True, "similarity": "cosine",
+            "index_options": {"type": variant["type"], "m": variant["m"], "ef_construction": variant["ef_construction"]},
+        }}},
+    )
+
+def index_vectors(index_name, variant, docs):
+    actions = [{"_index": index_name, "_id": str(idx), "embedding": variant_vector(variant, vector)} for idx, vector in enumerate(docs)]
+    payload_bytes = sum(len(SERIALIZER.dumps({"embedding": action["embedding"]})) for action in actions)
+    t0 = time.perf_counter()
+    helpers.bulk(ES.options(request_timeout=300), actions, chunk_size=500)
+    ES.indices.refresh(index=index_name)
+    index_seconds = time.perf_counter() - t0
+    ES.options(request_timeout=1800).indices.forcemerge(index=index_name, max_num_segments=1)
+    return payload_bytes, index_seconds
+
+def index_sizes(index_name):
+    store_bytes = ES.indices.stats(index=index_name, metric="store")["indices"][index_name]["primaries"]["store"]["size_in_bytes"]
+    disk_usage = ES.options(request_timeout=1800).indices.disk_usage(index=index_name, run_expensive_tasks=True)
+    return store_bytes, disk_usage[index_name]["fields"]["embedding"]["total_in_bytes"]
+
+def vector_ram_bytes(variant, docs_count):
+    per_vector = variant["dims"] * BYTES_PER_DIM[variant["type"]] + EXTRA_BYTES_PER_VECTOR[variant["type"]] + 4 * variant["m"]
+    return docs_count * per_vector
+
+def search_vectors(index_name, variant, queries, k):
+    num_candidates = min(int(k * variant["num_candidates_factor"]), KNN_MAX_NUM_CANDIDATES)
+    latencies = []
+    found_ids = []
+    for query_idx, query in enumerate(np.concatenate([queries[:BENCH_KNN_WARMUP], queries])):
+        knn = {"field": "embedding", "query_vector": variant_vector(variant, query), "k": k, "num_candidates": num_candidates}
+        t0 = time.perf_counter()
+        response = ES.search(index=index_name, knn=knn, size=k, source=False)
+        if query_idx < BENCH_KNN_WARMUP:
+            continue
+        latencies.append(time.perf_counter() - t0)
+        found_ids.append([int(hit["_id"]) for hit in response["hits"]["hits"]])
+    return latencies, found_ids
+
+def recall_at_k(found_ids, exact_ids, k):
+    return float(np.mean([len(set(found) & set(exact.tolist())) / k for found, exact in zip(found_ids, exact_ids)]))
+
+def run_variant(variant, docs, queries, exact_ids):
+    index_name = f"bench_knn_{variant['name']}"
+    create_index(index_name, variant)
+    payload_bytes, index_seconds = index_vectors(index_name, variant, docs)
+    store_bytes, embedding_bytes = index_sizes(index_name)
+    latencies, found_ids = search_vectors(index_name, variant, queries, BENCH_KNN_K)
+    ES.indices.delete(index=index_name)
+    return {
+        "payload_mb": payload_bytes / 1024 / 1024,
+        "docs_per_second": len(docs) / index_seconds,
+        "store_mb": store_bytes / 1024 / 1024,
+        "embedding_mb": embedding_bytes / 1024 / 1024,
+        "vector_ram_mb": vector_ram_bytes(variant, len(docs)) / 1024 / 1024,
+        "p50_ms": float(np.percentile(latencies, 50)) * 1000,
+        "p95_ms": float(np.percentile(latencies, 95)) * 1000,
+        "recall": recall_at_k(found_ids, exact_ids, BENCH_KNN_K),
+    }
+
+def main():
+    vectors = load_vectors(BENCH_KNN_DOCS + BENCH_KNN_QUERIES)
+    docs = vectors[:-BENCH_KNN_QUERIES]
+    queries = vectors[-BENCH_KNN_QUERIES:]
+    exact_ids = np.argsort(-(queries @ docs.T), axis=1)[:, :BENCH_KNN_K]
+    logger.info(f"🏁 kNN benchmark: source={BENCH_KNN_SOURCE}, docs={len(docs)}, queries={len(queries)}, dims={vectors.shape[1]}, k={BENCH_KNN_K}")
+    for variant in VARIANTS:
+        variant = {**variant, "dims": min(variant["dims"], vectors.shape[1])}
+        result = run_variant(variant, docs, queries, exact_ids)
+        logger.info(
+            f"📊 {variant['name']} ({variant['type']}, m={variant['m']}, ef_construction={variant['ef_construction']}, "
+            f"dims={variant['dims']}, decimals={variant['decimals']}, num_candidates=k*{variant['num_candidates_factor']}): "
+            f"payload={result['payload_mb']:.1f} MB, {result['docs_per_second']:.0f} docs/s, "
+            f"store={result['store_mb']:.1f} MB (embedding {result['embedding_mb']:.1f} MB), vector RAM≈{result['vector_ram_mb']:.1f} MB, "
+            f"p50={result['p50_ms']:.1f} ms, p95={result['p95_ms']:.1f} ms, recall@{BENCH_KNN_K}={result['recall']:.3f}"
+        )
+
+if __name__ == "__main__":
+    main()
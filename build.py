@@ -1,22 +1,28 @@
+import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime, UTC
 import mimetypes
 
-from elasticsearch import Elasticsearch, helpers
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from anthropic import Anthropic
 
 from utils import (
-    ES_URL, ES_INDEX_CHUNKS, ES_INDEX_FILE_MANIFEST,
-    EMBED_MODEL, REPOS_SAFE_ROOT, git_blob_oid, setup_logging, is_ignored, to_posix,
-    CLAUDE_MODEL, ANTHROPIC_API_KEY, LANG_BY_EXT, load_prompt
+    ES_INDEX_CHUNKS, ES_INDEX_FILE_MANIFEST,
+    EMBED_MODEL, REPOS_ROOT, REPOS_SAFE_ROOT, SCAN_CACHE_FILE, SCAN_GIT_OIDS, setup_logging,
+    BUILD_SPLIT_MODE, BUILD_SUBTREES, SPLIT_BATCH_SIZE, SPLIT_BATCH_POLL_SECONDS,
+    SPLIT_WINDOW_LINES, SPLIT_WINDOW_TOKENS, SPLIT_WINDOW_OVERLAP, SPLIT_WINDOW_WORKERS, MAX_CHUNK_LINES, MAX_CHUNK_TOKENS,
+    CLAUDE_MODEL, ANTHROPIC_API_KEY, LANG_BY_EXT, SEARCH_BACKEND, CHARS_PER_TOKEN, load_prompt, estimate_tokens, compact_vector
 )
 from tools import SPLIT_BLOCKS_TOOL
+from scan import scan_hashes, load_git_oids
+from metrics import measure, export_metrics
+from storage import STORAGE
+from journal import enqueue_job, drop_jobs_except, pending_jobs, next_due_job, next_retry_at, advance_job, complete_job, fail_job
 
 logger = setup_logging(Path(__file__).stem)
 
-ES = Elasticsearch(ES_URL, request_timeout=30, max_retries=3, retry_on_timeout=True)
 CLAUDE = Anthropic(api_key=ANTHROPIC_API_KEY)
 
 EMBEDDING = HuggingFaceEmbedding(EMBED_MODEL, normalize=True)
@@ -104,49 +110,20 @@ def normalize_blocks(blocks, total_lines, rel_path):
     return normalized_blocks
 
 def delete_file_data(rel_path):
-    query = {"term": {"path": rel_path}}
-    chunks_result = ES.options(request_timeout=120).delete_by_query(
-        index=ES_INDEX_CHUNKS,
-        body={"query": query},
-        conflicts="proceed",
-        refresh=True,
-        allow_no_indices=True
-    )
-    chunks_deleted = chunks_result.get("deleted", 0)
-    manifest_result = ES.options(request_timeout=120).delete_by_query(
-        index=ES_INDEX_FILE_MANIFEST,
-        body={"query": query},
-        conflicts="proceed",
-        refresh=True,
-        allow_no_indices=True
-    )
-    manifest_deleted = manifest_result.get("deleted", 0)
-    logger.info(f"🗑️  Deleted {rel_path}: {chunks_deleted} chunks, {manifest_deleted} manifest")
+    deleted = STORAGE.delete_file(rel_path)
+    logger.info(f"🗑️  Deleted {rel_path}: {deleted['chunks']} chunks, {deleted['manifest']} manifest, {deleted['symbols']} symbols")
 
-def index_es_file(rel_path, new_hash):
-    t0 = time.time()
-    full_path = REPOS_SAFE_ROOT / rel_path
-    if not full_path.exists():
-        raise FileNotFoundError(f"Файл не найден: {rel_path}")
-    file_text = full_path.read_text(encoding='utf-8', errors='ignore')
-    if not file_text:
-        raise RuntimeError(f"Пустой файл: {rel_path}")
-    ext = full_path.suffix.lower()
-    lang = LANG_BY_EXT.get(ext, "text")
-    file_size = full_path.stat().st_size
-    file_extension = ext[1:] if ext else ""
-    file_name = full_path.name
-    file_mime = mimetypes.guess_type(str(full_path))[0] or ""
-    now_iso = datetime.now(UTC).isoformat()
-    response = CLAUDE.messages.create(
-        model=CLAUDE_MODEL,
-        max_tokens=4096,
-        temperature=0,
-        system=[{"type": "text", "text": SPLIT_SYSTEM, "cache_control": {"type": "ephemeral"}}],
-        messages=[{"role": "user", "content": [{"type": "text", "text": file_text, "cache_control": {"type": "ephemeral"}}]}],
-        tools=[SPLIT_BLOCKS_TOOL],
-        extra_headers={"anthropic-beta": "prompt-caching-2024-07-31"}
-    )
+def split_request(file_text):
+    return {
+        "model": CLAUDE_MODEL,
+        "max_tokens": 4096,
+        "temperature": 0,
+        "system": [{"type": "text", "text": SPLIT_SYSTEM, "cache_control": {"type": "ephemeral"}}],
+        "messages": [{"role": "user", "content": [{"type": "text", "text": file_text, "cache_control": {"type": "ephemeral"}}]}],
+        "tools": [SPLIT_BLOCKS_TOOL],
+    }
+
+def parse_split_response(rel_path, response):
     tool_use_block = next((b for b in response.content if b.type == "tool_use"), None)
     text_content = "\n".join(b.text for b in response.content if b.type == "text")
     if text_content:
@@ -158,9 +135,133 @@ def index_es_file(rel_path, new_hash):
     blocks = tool_use_block.input.get("blocks")
     if not isinstance(blocks, list):
         raise RuntimeError(f"Claude вернул некорректные blocks для {rel_path}: ожидается список, получен {type(blocks).__name__}")
+    return blocks
+
+def split_blocks(rel_path, file_text):
+    response = CLAUDE.messages.create(**split_request(file_text), extra_headers={"anthropic-beta": "prompt-caching-2024-07-31"})
+    return parse_split_response(rel_path, response)
+
+def line_windows(lines_list):
+    line_tokens = [estimate_tokens(line) for line in lines_list]
+    windows = []
+    start_line = 1
+    while True:
+        end_line = start_line
+        window_tokens = line_tokens[start_line - 1]
+        while (end_line < len(lines_list) and end_line - start_line + 1 < SPLIT_WINDOW_LINES
+               and window_tokens + line_tokens[end_line] <= SPLIT_WINDOW_TOKENS):
+            window_tokens += line_tokens[end_line]
+            end_line += 1
+        windows.append((start_line, end_line))
+        if end_line == len(lines_list):
+            return windows
+        overlap = min(SPLIT_WINDOW_OVERLAP, (end_line - start_line + 1) // 10)
+        start_line = end_line + 1 - overlap
+
+def needs_windows(file_text):
+    return file_text.count('\n') + 1 > SPLIT_WINDOW_LINES or estimate_tokens(file_text) > SPLIT_WINDOW_TOKENS
+
+def split_window(rel_path, lines_list, window):
+    start_line, end_line = window
+    if start_line == end_line and estimate_tokens(lines_list[start_line - 1]) > SPLIT_WINDOW_TOKENS:
+        return [{"start_line": start_line, "end_line": end_line, "title": f"line {start_line}", "kind": "logic_block", "symbols": []}]
+    blocks = split_blocks(f"{rel_path}:{start_line}-{end_line}", '\n'.join(lines_list[start_line-1:end_line]))
+    offset = start_line - 1
+    return [{**b, "start_line": b["start_line"] + offset, "end_line": b["end_line"] + offset} for b in blocks]
+
+def choose_seam(overlap_start, overlap_end, next_blocks):
+    if overlap_start > overlap_end:
+        return overlap_start
+    midpoint = (overlap_start + overlap_end) // 2
+    candidates = [b["start_line"] for b in next_blocks if overlap_start < b["start_line"] <= overlap_end]
+    if not candidates:
+        return midpoint
+    return min(candidates, key=lambda line: abs(line - midpoint))
+
+def stitch_windows(windows, window_blocks):
+    stitched = window_blocks[0]
+    for (_, overlap_end), (overlap_start, _), next_blocks in zip(windows, windows[1:], window_blocks[1:]):
+        seam = choose_seam(overlap_start, overlap_end, next_blocks)
+        stitched = [{**b, "end_line": min(b["end_line"], seam - 1)} for b in stitched if b["start_line"] < seam]
+        stitched += [{**b, "start_line": max(b["start_line"], seam)} for b in next_blocks if b["end_line"] >= seam]
+    return stitched
+
+def split_windows(rel_path, file_text):
+    lines_list = file_text.split('\n')
+    windows = line_windows(lines_list)
+    with ThreadPoolExecutor(max_workers=SPLIT_WINDOW_WORKERS) as pool:
+        futures = [pool.submit(split_window, rel_path, lines_list, window) for window in windows]
+        window_blocks = [future.result() for future in futures]
+    logger.info(f"🪟 Split {rel_path} ({len(lines_list)} lines) in {len(windows)} windows")
+    return stitch_windows(windows, window_blocks)
+
+def bound_blocks(blocks, lines_list):
+    bounded = []
+    for block in blocks:
+        parts = []
+        part_start = block["start_line"]
+        part_tokens = 0
+        for line_no in range(block["start_line"], block["end_line"] + 1):
+            line = lines_list[line_no - 1]
+            line_tokens = estimate_tokens(line)
+            if line_tokens > MAX_CHUNK_TOKENS:
+                if line_no > part_start:
+                    parts.append({"start_line": part_start, "end_line": line_no - 1})
+                line_chars = MAX_CHUNK_TOKENS * CHARS_PER_TOKEN
+                for start_char in range(0, len(line), line_chars):
+                    parts.append({"start_line": line_no, "end_line": line_no, "start_char": start_char, "end_char": min(start_char + line_chars, len(line))})
+                part_start = line_no + 1
+                part_tokens = 0
+                continue
+            if line_no > part_start and (line_no - part_start >= MAX_CHUNK_LINES or part_tokens + line_tokens > MAX_CHUNK_TOKENS):
+                parts.append({"start_line": part_start, "end_line": line_no - 1})
+                part_start = line_no
+                part_tokens = 0
+            part_tokens += line_tokens
+        if part_start <= block["end_line"]:
+            parts.append({"start_line": part_start, "end_line": block["end_line"]})
+        if len(parts) == 1 and "start_char" not in parts[0]:
+            bounded.append(block)
+            continue
+        for idx, part in enumerate(parts, start=1):
+            bounded.append({**block, **part, "title": f"{block['title']} ({idx}/{len(parts)})"})
+    return bounded
+
+def stream_split_batches(batches_api, root, rel_paths):
+    paths_by_batch = {}
+    for offset in range(0, len(rel_paths), SPLIT_BATCH_SIZE):
+        batch_paths = {f"file-{offset + idx}": rel_path for idx, rel_path in enumerate(rel_paths[offset:offset + SPLIT_BATCH_SIZE])}
+        requests = [
+            {"custom_id": custom_id, "params": split_request((root / rel_path).read_text(encoding='utf-8', errors='ignore'))}
+            for custom_id, rel_path in batch_paths.items()
+        ]
+        batch = batches_api.create(requests=requests)
+        paths_by_batch[batch.id] = batch_paths
+        logger.info(f"📨 Submitted split batch {batch.id} ({len(requests)} files)")
+    while paths_by_batch:
+        ended = [batch_id for batch_id in paths_by_batch if batches_api.retrieve(batch_id).processing_status == "ended"]
+        if not ended:
+            time.sleep(SPLIT_BATCH_POLL_SECONDS)
+            continue
+        for batch_id in ended:
+            batch_paths = paths_by_batch.pop(batch_id)
+            logger.info(f"📬 Split batch {batch_id} ended, {len(paths_by_batch)} batches left")
+            for entry in batches_api.results(batch_id):
+                yield batch_paths[entry.custom_id], entry.result
+
+def file_metadata(full_path):
+    ext = full_path.suffix.lower()
+    return {
+        "file_size": full_path.stat().st_size,
+        "extension": ext[1:] if ext else "",
+        "filename": full_path.name,
+        "mime": mimetypes.guess_type(str(full_path))[0] or "",
+        "lang": LANG_BY_EXT.get(ext, "text"),
+    }
+
+def build_chunks(rel_path, new_hash, full_path, file_text, blocks, now_iso):
+    metadata = file_metadata(full_path)
     lines = file_text.count('\n') + 1
-    analyze_block_issues(blocks, lines, rel_path)
-    blocks = normalize_blocks(blocks, lines, rel_path)
     total = len(blocks)
     lines_list = file_text.split('\n')
     chunks = []
@@ -168,6 +269,8 @@ def index_es_file(rel_path, new_hash):
         start_line = block_def["start_line"]
         end_line = block_def["end_line"]
         block_text = '\n'.join(lines_list[start_line-1:end_line])
+        if "start_char" in block_def:
+            block_text = block_text[block_def["start_char"]:block_def["end_char"]]
         if isinstance(block_def["symbols"], list):
             block_def["symbols"] = list(dict.fromkeys(block_def["symbols"]))
         chunks.append({
@@ -177,22 +280,21 @@ def index_es_file(rel_path, new_hash):
             "path": rel_path,
             "hash": new_hash,
             "text": block_text,
-            "embedding": EMBEDDING.get_text_embedding(block_text),
+            "embedding": compact_vector(EMBEDDING.get_text_embedding(block_text)),
             "chunk_id": i,
             "chunks": total,
-            "file_size": file_size,
             "size": len(block_text.encode('utf-8')),
             "file_lines": lines,
-            "extension": file_extension,
-            "filename": file_name,
-            "mime": file_mime,
-            "lang": lang,
+            **metadata,
             "created_at": now_iso,
             "updated_at": now_iso,
             "llm_version": CLAUDE_MODEL,
             **block_def
         })
-    manifest = {
+    return chunks
+
+def build_manifest(rel_path, new_hash, now_iso):
+    return {
         "_op_type": "index",
         "_index": ES_INDEX_FILE_MANIFEST,
         "_id": rel_path,
@@ -201,55 +303,198 @@ def index_es_file(rel_path, new_hash):
         "created_at": now_iso,
         "updated_at": now_iso
     }
-    helpers.bulk(ES.options(request_timeout=120), chunks, chunk_size=2000, raise_on_error=True)
-    helpers.bulk(ES.options(request_timeout=120), [manifest], chunk_size=1, raise_on_error=True)
+
+def read_file_text(rel_path):
+    full_path = REPOS_SAFE_ROOT / rel_path
+    if not full_path.exists():
+        raise FileNotFoundError(f"Файл не найден: {rel_path}")
+    file_text = full_path.read_text(encoding='utf-8', errors='ignore')
+    if not file_text:
+        raise RuntimeError(f"Пустой файл: {rel_path}")
+    return file_text
+
+def split_file(rel_path, file_text):
+    if needs_windows(file_text):
+        return finalize_blocks(rel_path, file_text, split_windows(rel_path, file_text))
+    return finalize_blocks(rel_path, file_text, split_blocks(rel_path, file_text))
+
+def finalize_blocks(rel_path, file_text, blocks):
+    lines = file_text.count('\n') + 1
+    analyze_block_issues(blocks, lines, rel_path)
+    return bound_blocks(normalize_blocks(blocks, lines, rel_path), file_text.split('\n'))
+
+def write_file_data(rel_path, new_hash, chunks, now_iso):
+    manifest = build_manifest(rel_path, new_hash, now_iso)
+    STORAGE.write_file(chunks, manifest)
+
+def is_empty_file(rel_path):
+    return (REPOS_SAFE_ROOT / rel_path).stat().st_size == 0
+
+def index_empty_file(rel_path, new_hash):
+    write_file_data(rel_path, new_hash, [], datetime.now(UTC).isoformat())
+    logger.info(f"📭 Added empty {rel_path} (manifest only)")
+
+def index_es_file(rel_path, new_hash):
+    t0 = time.time()
+    with measure("index_stage", {"stage": "read"}):
+        file_text = read_file_text(rel_path)
+    now_iso = datetime.now(UTC).isoformat()
+    with measure("index_stage", {"stage": "split"}):
+        blocks = split_file(rel_path, file_text)
+    with measure("index_stage", {"stage": "embed"}):
+        chunks = build_chunks(rel_path, new_hash, REPOS_SAFE_ROOT / rel_path, file_text, blocks, now_iso)
+    with measure("index_stage", {"stage": "write"}):
+        write_file_data(rel_path, new_hash, chunks, now_iso)
     logger.info(f"➕ Added {rel_path} ({len(chunks)} chunks) in {time.time()-t0:.2f}s")
 
-def get_file_manifest():
-    query = {"_source": ["path","hash"], "query": {"match_all": {}}, "size": 1000}
-    scroll = ES.search(index=ES_INDEX_FILE_MANIFEST, body=query, scroll="5m")
-    scroll_id = scroll.get("_scroll_id")
-    hits = scroll["hits"]["hits"]
-    result = {}
-    while hits:
-        for hit in hits:
-            src = hit.get("_source", {})
-            result[src.get("path")] = src.get("hash")
-        scroll = ES.scroll(scroll_id=scroll_id, scroll="5m")
-        scroll_id = scroll.get("_scroll_id", scroll_id)
-        hits = scroll["hits"]["hits"]
-    if scroll_id:
-        ES.clear_scroll(scroll_id=scroll_id)
-    logger.info(f"📋 Loaded {len(result)} file manifests from ES")
+def move_file_data(old_rel_path, new_rel_path, new_hash):
+    t0 = time.time()
+    now_iso = datetime.now(UTC).isoformat()
+    metadata = file_metadata(REPOS_SAFE_ROOT / new_rel_path)
+    chunks = []
+    for source in STORAGE.file_chunks(old_rel_path):
+        chunks.append({
+            **source,
+            **metadata,
+            "_op_type": "index",
+            "_index": ES_INDEX_CHUNKS,
+            "_id": f"{new_rel_path}#{source['chunk_id']}/{source['chunks']}",
+            "path": new_rel_path,
+            "hash": new_hash,
+            "updated_at": now_iso,
+        })
+    write_file_data(new_rel_path, new_hash, chunks, now_iso)
+    delete_file_data(old_rel_path)
+    logger.info(f"🔀 Moved {old_rel_path} → {new_rel_path} ({len(chunks)} chunks) in {time.time()-t0:.2f}s")
+
+def get_repo_commit(repo):
+    return STORAGE.get_commit(repo)
+
+def set_repo_commit(repo, commit):
+    now_iso = datetime.now(UTC).isoformat()
+    STORAGE.set_commit(repo, {"path": repo, "commit": commit, "created_at": now_iso, "updated_at": now_iso})
+    logger.info(f"📌 {repo} indexed at {commit[:8]}")
+
+def get_file_manifest(subtrees):
+    t0 = time.time()
+    result = STORAGE.file_manifest(subtrees)
+    logger.info(f"📋 Loaded {len(result)} file manifests from {SEARCH_BACKEND}{f' for {subtrees}' if subtrees else ''} in {time.time()-t0:.2f}s")
     return result
 
+def get_manifest_hash(rel_path):
+    return STORAGE.manifest_hash(rel_path)
+
+def sync_file(rel_path, current_hash, stored_hash):
+    if current_hash == stored_hash:
+        if current_hash:
+            logger.debug(f"⏭️  Skipped {rel_path} (unchanged, hash={current_hash[:8]})")
+        return
+    if stored_hash:
+        delete_file_data(rel_path)
+    if current_hash and is_empty_file(rel_path):
+        index_empty_file(rel_path, current_hash)
+    elif current_hash:
+        index_es_file(rel_path, current_hash)
+
+def process_job(job):
+    t0 = time.time()
+    rel_path = job["path"]
+    with measure("index_stage", {"stage": "read"}):
+        file_text = read_file_text(rel_path)
+    now_iso = datetime.now(UTC).isoformat()
+    state = job["state"]
+    payload = job["payload"]
+    if state == "pending":
+        with measure("index_stage", {"stage": "split"}):
+            payload = json.dumps(split_file(rel_path, file_text), ensure_ascii=False)
+        state = "split"
+        advance_job(rel_path, state, payload)
+    if state == "split":
+        with measure("index_stage", {"stage": "embed"}):
+            chunks = build_chunks(rel_path, job["hash"], REPOS_SAFE_ROOT / rel_path, file_text, json.loads(payload), now_iso)
+        payload = json.dumps(chunks, ensure_ascii=False)
+        state = "embedded"
+        advance_job(rel_path, state, payload)
+    chunks = json.loads(payload)
+    with measure("index_stage", {"stage": "write"}):
+        if job["stored_hash"]:
+            delete_file_data(rel_path)
+        write_file_data(rel_path, job["hash"], chunks, now_iso)
+    complete_job(rel_path, time.time() - t0)
+    logger.info(f"➕ Added {rel_path} ({len(chunks)} chunks) in {time.time()-t0:.2f}s")
+
+def run_job(job):
+    try:
+        with measure("index_file", {}):
+            process_job(job)
+    except Exception as e:
+        fail_job(job["path"], job["attempts"] + 1, str(e))
+
+def run_jobs():
+    while True:
+        job = next_due_job()
+        if job:
+            run_job(job)
+            continue
+        retry_at = next_retry_at()
+        if retry_at is None:
+            return
+        logger.info(f"⏳ Waiting {retry_at - time.time():.0f}s for next retry")
+        time.sleep(max(0.0, retry_at - time.time()))
+
+def batch_split_jobs():
+    jobs_by_path = {}
+    for job in pending_jobs():
+        try:
+            file_text = read_file_text(job["path"])
+        except Exception as e:
+            fail_job(job["path"], job["attempts"] + 1, str(e))
+            continue
+        if not needs_windows(file_text):
+            jobs_by_path[job["path"]] = dict(job)
+    return jobs_by_path
+
+def run_split_batches(batches_api):
+    jobs_by_path = batch_split_jobs()
+    logger.info(f"📦 Batch split for {len(jobs_by_path)} pending files, larger files go through windowed split")
+    for rel_path, result in stream_split_batches(batches_api, REPOS_SAFE_ROOT, list(jobs_by_path)):
+        job = jobs_by_path[rel_path]
+        try:
+            if result.type != "succeeded":
+                raise RuntimeError(f"Batch-запрос разбиения {rel_path} завершился со статусом {result.type}")
+            blocks = finalize_blocks(rel_path, read_file_text(rel_path), parse_split_response(rel_path, result.message))
+        except Exception as e:
+            fail_job(rel_path, job["attempts"] + 1, str(e))
+            continue
+        payload = json.dumps(blocks, ensure_ascii=False)
+        advance_job(rel_path, "split", payload)
+        run_job({**job, "state": "split", "payload": payload})
+
 def process_files():
     logger.info(f"🔍 Scanning {REPOS_SAFE_ROOT} for files...")
-    indexed_hash_by_file = get_file_manifest()
-    processed_paths = set()
-    for full in (f for f in REPOS_SAFE_ROOT.rglob('**/*') if f.is_file()):
-        rel_path = to_posix(full.relative_to(REPOS_SAFE_ROOT))
-        if is_ignored(rel_path):
-            current_hash = None
-        else:
-            current_hash = git_blob_oid(full)
+    indexed_hash_by_file = get_file_manifest(BUILD_SUBTREES)
+    oid_by_file = load_git_oids(REPOS_ROOT) if SCAN_GIT_OIDS else {}
+    current_hash_by_file = scan_hashes(REPOS_SAFE_ROOT, SCAN_CACHE_FILE, oid_by_file, BUILD_SUBTREES)
+    planned_paths = set()
+    for rel_path, current_hash in current_hash_by_file.items():
+        stored_hash = indexed_hash_by_file.get(rel_path)
+        if current_hash == stored_hash:
+            continue
+        if current_hash and not is_empty_file(rel_path):
+            enqueue_job(rel_path, current_hash, stored_hash)
+            planned_paths.add(rel_path)
+            continue
         try:
-            processed_paths.add(rel_path)
-            stored_hash = indexed_hash_by_file.get(rel_path)
-            if current_hash == stored_hash and current_hash is not None:
-                logger.debug(f"⏭️  Skipped {rel_path} (unchanged, hash={current_hash[:8]})")
-                continue
-            if not current_hash:
-                if stored_hash:
-                    delete_file_data(rel_path)
-                continue
-            if stored_hash and stored_hash != current_hash:
-                delete_file_data(rel_path)
-            index_es_file(rel_path, current_hash)
+            sync_file(rel_path, current_hash, stored_hash)
         except Exception as e:
             logger.error(f"❌ Failed to process file {rel_path}: {e}")
+    dropped = drop_jobs_except(planned_paths, BUILD_SUBTREES)
+    logger.info(f"🗂️  Journal: {len(planned_paths)} files to index, {dropped} stale jobs dropped")
+    if BUILD_SPLIT_MODE == "batch":
+        run_split_batches(CLAUDE.messages.batches)
+    run_jobs()
     for rel_path in indexed_hash_by_file.keys():
-        if rel_path not in processed_paths:
+        if rel_path not in current_hash_by_file:
             try:
                 delete_file_data(rel_path)
             except Exception as e:
@@ -264,7 +509,8 @@ def main():
         logger.error(f"💥 Build failed: {e}")
         raise
     finally:
-        ES.close()
+        export_metrics("build")
+        STORAGE.close()
 
 if __name__ == "__main__":
     main()
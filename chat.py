@@ -1,5 +1,7 @@
 import gradio as gr
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 from typing import Sequence
 from anthropic import Anthropic
@@ -9,13 +11,23 @@ from html import escape
 from utils import (
     CLAUDE_MODEL,
     ANTHROPIC_API_KEY,
+    CHAT_CONCURRENCY,
+    CHAT_QUEUE_SIZE,
+    METRICS_PORT,
+    SEARCH_BACKEND,
     load_prompt,
     setup_logging,
-    execute_command,
 )
+from sandbox import execute_command
 from db_utils import DB_CONNECTIONS, db_query
-from tools import MAIN_SEARCH_TOOL, EXECUTE_COMMAND_TOOL, SELECT_TOOLS
+from tools import MAIN_SEARCH_TOOL, FIND_SYMBOL_TOOL, EXECUTE_COMMAND_TOOL, READ_RESULT_TOOL, SELECT_TOOLS
+from results import shape_command_result, shape_rows, read_result_page
 from retriever import main_search
+from symbols import find_symbol
+from metrics import measure, inc, open_span, close_span, span_context, start_metrics_server
+from context import (
+    trim_turn, page_block, history_system, needs_compaction, compaction_request, compacted_pages, cache_hit_rate
+)
 
 logger = setup_logging(Path(__file__).stem)
 
@@ -25,20 +37,26 @@ NAVIGATION = load_prompt("templates/system_navigation.txt")
 TOOL_OUTPUT_TEMPLATE = load_prompt("templates/tool_output.html")
 TOOL_INPUT_TEMPLATE = load_prompt("templates/tool_input.html")
 STATS_TEMPLATE = load_prompt("templates/stats.html")
-TOOLS = [MAIN_SEARCH_TOOL, EXECUTE_COMMAND_TOOL] + SELECT_TOOLS
+TOOLS = [MAIN_SEARCH_TOOL] + ([FIND_SYMBOL_TOOL] if SEARCH_BACKEND == "elasticsearch" else []) + [EXECUTE_COMMAND_TOOL, READ_RESULT_TOOL] + SELECT_TOOLS
 MAX_TOOL_LOOPS = 12
+TOOL_WORKERS = 8
+TOOL_TIMEOUT_SECONDS = {"main_search": 60, "find_symbol": 15, "execute_command": 40}
+DB_TOOL_TIMEOUT_SECONDS = 40
+
+TOOL_EXECUTOR = ThreadPoolExecutor(max_workers=TOOL_WORKERS)
 
-TOKEN_STATS = {"input": 0, "cache_write": 0, "cache_read": 0, "output": 0}
+def new_token_stats():
+    return {"input": 0, "cache_write": 0, "cache_read": 0, "output": 0, "last_turn_cache_hit": 0.0}
 
-def track_tokens(response):
+def track_tokens(stats, response):
     if not response.usage:
         return
     cache_read = getattr(response.usage, "cache_read_input_tokens", 0) or 0
     cache_creation = getattr(response.usage, "cache_creation_input_tokens", 0) or 0
-    TOKEN_STATS["input"] += response.usage.input_tokens
-    TOKEN_STATS["cache_write"] += cache_creation
-    TOKEN_STATS["cache_read"] += cache_read
-    TOKEN_STATS["output"] += response.usage.output_tokens
+    stats["input"] += response.usage.input_tokens
+    stats["cache_write"] += cache_creation
+    stats["cache_read"] += cache_read
+    stats["output"] += response.usage.output_tokens
 
 def canon_json(obj) -> str:
     return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
@@ -109,21 +127,21 @@ def get_text_chunks(response) -> list[str]:
         if b.type == "text" and b.text.strip()
     ]
 
-def update_stats(history_pages):
+def update_stats(history_pages, token_stats):
     texts = [p["text"] for p in history_pages[-3:]]
     texts = [""] * (3 - len(texts)) + texts
     chars = [len(t) for t in texts]
     input_total = (
-        TOKEN_STATS["input"]
-        + TOKEN_STATS["cache_write"]
-        + TOKEN_STATS["cache_read"]
+        token_stats["input"]
+        + token_stats["cache_write"]
+        + token_stats["cache_read"]
     )
     paid_equiv = (
-        TOKEN_STATS["input"]
-        + 1.25 * TOKEN_STATS["cache_write"]
-        + 0.1 * TOKEN_STATS["cache_read"]
+        token_stats["input"]
+        + 1.25 * token_stats["cache_write"]
+        + 0.1 * token_stats["cache_read"]
     )
-    total_equiv = paid_equiv + TOKEN_STATS["output"]
+    total_equiv = paid_equiv + token_stats["output"]
     saved_equiv = input_total - paid_equiv
     return STATS_TEMPLATE.format(
         pages_count=len(history_pages),
@@ -135,19 +153,76 @@ def update_stats(history_pages):
         page3_text=escape(texts[0]),
         total_equiv=total_equiv,
         saved_equiv=saved_equiv,
-        input=TOKEN_STATS["input"],
-        cache_write=TOKEN_STATS["cache_write"],
-        cache_read=TOKEN_STATS["cache_read"],
-        output=TOKEN_STATS["output"],
+        input=token_stats["input"],
+        cache_write=token_stats["cache_write"],
+        cache_read=token_stats["cache_read"],
+        output=token_stats["output"],
+        cache_hit_pct=token_stats["last_turn_cache_hit"] * 100,
     )
 
-def chat(message, history, history_pages):
+def run_tool(name: str, tool_input: dict):
+    with measure("tool", {"tool": name}):
+        result = dispatch_tool(name, tool_input)
+    if isinstance(result, dict) and "error" in result:
+        inc("tool_errors_total", {"tool": name}, 1)
+    return result
+
+def dispatch_tool(name: str, tool_input: dict):
+    if name == "main_search":
+        return main_search(
+            tool_input["question"],
+            tool_input["path_prefix"],
+            tool_input["top_n"],
+            tool_input.get("symbols"),
+            tool_input.get("use_reranker", True),
+            tool_input.get("neighbors", 0),
+            tool_input.get("group_by_file", False),
+        )
+    if name == "find_symbol":
+        return find_symbol(
+            tool_input["symbol"],
+            tool_input["match"],
+            tool_input["path_prefix"],
+            tool_input["usages"],
+            tool_input["limit"],
+        )
+    if name == "execute_command":
+        return shape_command_result(execute_command(tool_input["command"]))
+    if name == "read_result":
+        return read_result_page(tool_input["result_id"], tool_input["offset"], tool_input["char_offset"], tool_input["limit"])
+    if name in DB_CONNECTIONS:
+        return shape_rows(db_query(name, tool_input["select"]))
+    return {"error": f"unknown tool {name}"}
+
+def tool_timeout(name: str) -> float:
+    return TOOL_TIMEOUT_SECONDS.get(name, DB_TOOL_TIMEOUT_SECONDS)
+
+def start_tool(tu, request_span):
+    future = TOOL_EXECUTOR.submit(span_context(request_span).run, run_tool, tu.name, tu.input)
+    return future, (tu, time.monotonic() + tool_timeout(tu.name))
+
+def finish_tools(running_tools: dict):
+    pending = set(running_tools)
+    while pending:
+        timeout = max(0.0, min(running_tools[f][1] for f in pending) - time.monotonic())
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield running_tools[future][0], future.result()
+        now = time.monotonic()
+        for future in [f for f in pending if running_tools[f][1] <= now]:
+            pending.discard(future)
+            future.cancel()
+            tu = running_tools[future][0]
+            inc("tool_timeouts_total", {"tool": tu.name}, 1)
+            yield tu, {"error": f"Инструмент {tu.name} не ответил за {tool_timeout(tu.name)} с"}
+
+def chat(message, history, history_pages, token_stats, request: gr.Request):
     message = (message or "").strip()
     logger.info("💬 %s...", message)
     history = history or []
     history_pages = history_pages or []
     if not message:
-        yield history, history_pages, ""
+        yield history, history_pages, token_stats, ""
         return
     raw: list[MessageParam] = []
     user_msg = user_text(message)
@@ -155,28 +230,56 @@ def chat(message, history, history_pages):
         raw.append(user_msg)
     answers = []
     current_history = history + [ui_msg("user", message)]
-    yield current_history, history_pages, ""
+    yield current_history, history_pages, token_stats, ""
     loops = 0
     last_tool_use: list[MessageParam] = []
     last_tool_results: list[MessageParam] = []
+    turn_tokens = {"input": 0, "cache_write": 0, "cache_read": 0, "output": 0}
+    started_at = time.perf_counter()
+    first_token_seconds = None
+    tool_calls = 0
+    request_span = open_span("chat_request", {}, None)
     while True:
         loops += 1
         if loops > MAX_TOOL_LOOPS:
             break
+        running_tools = {}
+        streamed_text = ""
+        streamed_idx = None
+        llm_span = open_span("llm_stream", {}, request_span)
         try:
-            response = BASE_LLM.messages.create(
+            with BASE_LLM.messages.stream(
                 model=CLAUDE_MODEL,
-                system=[SYSTEM_NAVIGATION_BLOCK] + history_pages[-3:],
-                messages=raw + last_tool_use + last_tool_results,
+                system=history_system(SYSTEM_NAVIGATION_BLOCK, history_pages),
+                messages=trim_turn(raw) + last_tool_use + last_tool_results,
                 tools=TOOLS,
                 max_tokens=4096,
-            )
+            ) as stream:
+                for event in stream:
+                    if event.type == "text":
+                        streamed_text += event.text
+                        if not streamed_text.strip():
+                            continue
+                        if streamed_idx is None:
+                            first_token_seconds = first_token_seconds or time.perf_counter() - started_at
+                            streamed_idx = len(answers)
+                            answers.append(ui_msg("assistant", streamed_text))
+                        answers[streamed_idx] = ui_msg("assistant", streamed_text)
+                        yield current_history + answers, history_pages, token_stats, ""
+                    elif event.type == "content_block_stop" and event.content_block.type == "tool_use":
+                        future, running_tool = start_tool(event.content_block, request_span)
+                        running_tools[future] = running_tool
+                response = stream.get_final_message()
+            close_span(llm_span, "ok")
         except Exception:
+            close_span(llm_span, "error")
+            close_span(request_span, "error")
             logger.exception("Ошибка при вызове LLM")
             answers.append(ui_msg("assistant", "Произошла ошибка при обращении к модели. Посмотри логи."))
-            yield current_history + answers, history_pages, ""
+            yield current_history + answers, history_pages, token_stats, ""
             return
-        track_tokens(response)
+        track_tokens(token_stats, response)
+        track_tokens(turn_tokens, response)
         last_tool_use = []
         last_tool_results = []
         text_chunks = get_text_chunks(response)
@@ -186,32 +289,19 @@ def chat(message, history, history_pages):
             assistant_msg = assistant_text(text)
             if assistant_msg:
                 raw.append(assistant_msg)
-            answers.append(ui_msg("assistant", text))
-            yield current_history + answers, history_pages, ""
+            answers[streamed_idx] = ui_msg("assistant", text)
+            yield current_history + answers, history_pages, token_stats, ""
         tool_uses = [b for b in response.content if b.type == "tool_use"]
         if tool_uses:
             logger.info("🔧 Использование инструментов: %s", tool_uses)
             last_tool_use = [tool_use_msg(tool_uses)]
+            tool_calls += len(tool_uses)
             input_logs = [format_tool_input(tu.name, tu.input) for tu in tool_uses]
             if input_logs:
                 answers.append(ui_msg("assistant", "".join(input_logs)))
-                yield current_history + answers, history_pages, ""
-            tool_results = []
-            for tu in tool_uses:
-                if tu.name == "main_search":
-                    result = main_search(
-                        tu.input["question"],
-                        tu.input["path_prefix"],
-                        tu.input["top_n"],
-                        tu.input.get("symbols"),
-                        tu.input.get("use_reranker", True),
-                    )
-                elif tu.name == "execute_command":
-                    result = execute_command(tu.input["command"])
-                elif tu.name in DB_CONNECTIONS:
-                    result = db_query(tu.name, tu.input["select"])
-                else:
-                    result = {"error": f"unknown tool {tu.name}"}
+                yield current_history + answers, history_pages, token_stats, ""
+            result_by_id = {}
+            for tu, result in finish_tools(running_tools):
                 logger.info(
                     "🔧 %s: input=%s, result=%s",
                     tu.name,
@@ -219,19 +309,39 @@ def chat(message, history, history_pages):
                     canon_json(result) if isinstance(result, (dict, list)) else str(result),
                 )
                 answers.append(ui_msg("assistant", format_tool_output(tu.name, result)))
-                yield current_history + answers, history_pages, ""
-                tool_results.append(tool_result_block(tu.id, result))
+                yield current_history + answers, history_pages, token_stats, ""
+                result_by_id[tu.id] = result
+            tool_results = [tool_result_block(tu.id, result_by_id[tu.id]) for tu in tool_uses]
             last_tool_results = [user_tool_results(tool_results)]
         if not tool_uses:
             break
     if raw:
-        history_pages.append(text_block_cached(canon_json(raw)))
+        history_pages.append(page_block(canon_json(trim_turn(raw))))
         logger.info("📝 Добавлена новая страница, всего страниц: %d", len(history_pages))
-    yield current_history + answers, history_pages, ""
+    if needs_compaction(history_pages):
+        summary_response = BASE_LLM.messages.create(**compaction_request(history_pages))
+        track_tokens(token_stats, summary_response)
+        summary_block = page_block(canon_json({"summary": "\n".join(get_text_chunks(summary_response))}))
+        history_pages = compacted_pages(history_pages, summary_block)
+        logger.info("🗜️ Старые страницы свёрнуты в сводку, всего страниц: %d", len(history_pages))
+    token_stats["last_turn_cache_hit"] = cache_hit_rate(turn_tokens)
+    logger.info("📊 Cache hit за ход: %.0f%% (%s)", token_stats["last_turn_cache_hit"] * 100, turn_tokens)
+    close_span(request_span, "ok")
+    logger.info(
+        "📈 Запрос session=%s: %.2fs, first_token=%s, loops=%d, tools=%d, tokens=%s",
+        request.session_hash,
+        time.perf_counter() - started_at,
+        f"{first_token_seconds:.2f}s" if first_token_seconds is not None else "n/a",
+        loops,
+        tool_calls,
+        turn_tokens,
+    )
+    yield current_history + answers, history_pages, token_stats, ""
 
 with gr.Blocks(title="RAG Assistant") as demo:
     gr.Markdown("# 🤖 RAG Assistant\n**Claude** с инструментами для навигации по коду")
     history_pages_state = gr.State([])
+    token_stats_state = gr.State(new_token_stats())
 
     chatbot = gr.Chatbot(
         height=600,
@@ -241,7 +351,7 @@ with gr.Blocks(title="RAG Assistant") as demo:
         sanitize_html=False,
     )
 
-    token_display = gr.Markdown(value=update_stats([]))
+    token_display = gr.Markdown(value=update_stats([], new_token_stats()))
 
     with gr.Row():
         message_input = gr.Textbox(
@@ -263,24 +373,27 @@ with gr.Blocks(title="RAG Assistant") as demo:
     def clear_chat():
         return [], [], ""
 
-    def update_stats_hook(history_pages):
-        return update_stats(history_pages)
+    def update_stats_hook(history_pages, token_stats):
+        return update_stats(history_pages, token_stats)
 
     chat_fn = message_input.submit(
         chat,
-        inputs=[message_input, chatbot, history_pages_state],
-        outputs=[chatbot, history_pages_state, message_input],
+        inputs=[message_input, chatbot, history_pages_state, token_stats_state],
+        outputs=[chatbot, history_pages_state, token_stats_state, message_input],
     )
-    chat_fn.then(update_stats_hook, inputs=[history_pages_state], outputs=[token_display])
+    chat_fn.then(update_stats_hook, inputs=[history_pages_state, token_stats_state], outputs=[token_display])
     submit_fn = submit.click(
         chat,
-        inputs=[message_input, chatbot, history_pages_state],
-        outputs=[chatbot, history_pages_state, message_input],
+        inputs=[message_input, chatbot, history_pages_state, token_stats_state],
+        outputs=[chatbot, history_pages_state, token_stats_state, message_input],
     )
-    submit_fn.then(update_stats_hook, inputs=[history_pages_state], outputs=[token_display])
+    submit_fn.then(update_stats_hook, inputs=[history_pages_state, token_stats_state], outputs=[token_display])
 
     clear_fn = clear.click(clear_chat, outputs=[chatbot, history_pages_state, message_input])
-    clear_fn.then(lambda: update_stats([]), outputs=[token_display])
+    clear_fn.then(lambda token_stats: update_stats([], token_stats), inputs=[token_stats_state], outputs=[token_display])
 
 if __name__ == "__main__":
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    demo.queue(default_concurrency_limit=CHAT_CONCURRENCY, max_size=CHAT_QUEUE_SIZE)
     demo.launch(server_name="0.0.0.0", server_port=7860, share=False)
@@ -0,0 +1,56 @@
+from utils import (
+    CLAUDE_MODEL, CHARS_PER_TOKEN, HISTORY_PAGE_MAX_TOKENS, HISTORY_RECENT_PAGES, HISTORY_MAX_PAGES,
+    HISTORY_SUMMARY_MAX_TOKENS, estimate_tokens, load_prompt
+)
+
+COMPACT_SYSTEM = load_prompt("templates/system_compact_history.txt")
+
+def message_text(msg) -> str:
+    return msg["content"][0]["text"]
+
+def trim_turn(raw):
+    budget = HISTORY_PAGE_MAX_TOKENS - estimate_tokens(message_text(raw[0]))
+    kept = []
+    for msg in reversed(raw[1:]):
+        tokens = estimate_tokens(message_text(msg))
+        if tokens > budget:
+            break
+        kept.append(msg)
+        budget -= tokens
+    if not kept and len(raw) > 1:
+        cut_text = message_text(raw[-1])[:max(budget, 0) * CHARS_PER_TOKEN] + "…"
+        kept.append({"role": raw[-1]["role"], "content": [{"type": "text", "text": cut_text}]})
+    return [raw[0], *reversed(kept)]
+
+def page_block(text: str) -> dict:
+    return {"type": "text", "text": text}
+
+def cached(block: dict) -> dict:
+    return {**block, "cache_control": {"type": "ephemeral"}}
+
+def history_system(navigation_block, history_pages):
+    if not history_pages:
+        return [navigation_block]
+    if len(history_pages) == 1:
+        return [navigation_block, cached(history_pages[0])]
+    return [navigation_block, cached(history_pages[0]), *history_pages[1:-1], cached(history_pages[-1])]
+
+def needs_compaction(history_pages) -> bool:
+    return len(history_pages) > HISTORY_MAX_PAGES
+
+def compaction_request(history_pages) -> dict:
+    folded_text = "\n\n".join(page["text"] for page in history_pages[:-HISTORY_RECENT_PAGES])
+    return {
+        "model": CLAUDE_MODEL,
+        "max_tokens": HISTORY_SUMMARY_MAX_TOKENS,
+        "temperature": 0,
+        "system": COMPACT_SYSTEM,
+        "messages": [{"role": "user", "content": [{"type": "text", "text": folded_text}]}],
+    }
+
+def compacted_pages(history_pages, summary_block):
+    return [summary_block, *history_pages[-HISTORY_RECENT_PAGES:]]
+
+def cache_hit_rate(turn_tokens) -> float:
+    prompt_tokens = turn_tokens["input"] + turn_tokens["cache_write"] + turn_tokens["cache_read"]
+    return turn_tokens["cache_read"] / prompt_tokens if prompt_tokens else 0.0
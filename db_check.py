@@ -0,0 +1,65 @@
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine, text
+
+from utils import DB_MAX_FETCH_ROWS, setup_logging
+from db_utils import DB_CONNECTIONS, DB_SLOTS, db_query
+
+logger = setup_logging(Path(__file__).stem)
+
+CHECK_TOOL_NAME = "check_sqlite"
+SLOT_WAIT_SECONDS = 0.5
+
+def check(condition, message):
+    if not condition:
+        raise RuntimeError(f"Проверка не пройдена: {message}")
+    logger.info(f"✅ {message}")
+
+def create_database(db_file):
+    engine = create_engine(f"sqlite:///{db_file}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)"))
+        connection.execute(text("INSERT INTO items (id, name) VALUES (:id, :name)"), [{"id": idx, "name": f"item {idx}"} for idx in range(DB_MAX_FETCH_ROWS + 5)])
+        connection.execute(text("INSERT INTO items (id, name) VALUES (-1, 'a  b'), (-2, 'a b')"))
+    engine.dispose()
+
+def check_row_limit():
+    result = db_query(CHECK_TOOL_NAME, "SELECT id FROM items")
+    check(len(result["rows"]) == DB_MAX_FETCH_ROWS and not result["complete"], f"выборка ограничена {DB_MAX_FETCH_ROWS} строками, complete=False")
+
+def check_cache():
+    first = db_query(CHECK_TOOL_NAME, "select name from items where id < 0 order by id")
+    second = db_query(CHECK_TOOL_NAME, "SELECT   name\nFROM items WHERE id < 0 ORDER BY id -- comment")
+    check("cached" not in first and second["cached"], "запрос, отличающийся регистром ключевых слов, пробелами и комментарием, берётся из кэша")
+    spaced = db_query(CHECK_TOOL_NAME, "SELECT id FROM items WHERE name = 'a  b'")
+    single = db_query(CHECK_TOOL_NAME, "SELECT id FROM items WHERE name = 'a b'")
+    check(spaced["rows"] == [{"id": -1}] and single["rows"] == [{"id": -2}] and "cached" not in single, "пробелы внутри строковых литералов различают ключ кэша")
+
+def check_semaphore():
+    result = {}
+    DB_SLOTS[CHECK_TOOL_NAME].acquire()
+    worker = threading.Thread(target=lambda: result.update(db_query(CHECK_TOOL_NAME, "SELECT COUNT(*) AS total FROM items")))
+    worker.start()
+    worker.join(SLOT_WAIT_SECONDS)
+    check(worker.is_alive(), "запрос ждёт, пока занят единственный слот базы")
+    DB_SLOTS[CHECK_TOOL_NAME].release()
+    worker.join()
+    check(result["rows"] == [{"total": DB_MAX_FETCH_ROWS + 7}], "после освобождения слота запрос выполняется")
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = Path(tmp_dir) / "check.sqlite"
+        create_database(db_file)
+        DB_CONNECTIONS[CHECK_TOOL_NAME] = {"url": f"jdbc:sqlite:{db_file}", "username": None, "password": None, "description": "", "pool_size": 1, "max_concurrency": 1}
+        DB_SLOTS[CHECK_TOOL_NAME] = threading.BoundedSemaphore(1)
+        t0 = time.time()
+        check_row_limit()
+        check_cache()
+        check_semaphore()
+        logger.info(f"✨ db_utils checks passed in {time.time()-t0:.2f}s")
+
+if __name__ == "__main__":
+    main()
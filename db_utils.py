@@ -1,9 +1,18 @@
 import os
+import threading
+import time
+from collections import OrderedDict
 from urllib.parse import urlparse
 from sqlalchemy import create_engine, text
 import sqlparse
 
+from utils import (
+    DB_FETCH_BATCH, DB_MAX_FETCH_ROWS, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+    DB_MAX_CONCURRENCY, DB_CACHE_TTL_SECONDS, DB_CACHE_SIZE
+)
+
 _ENGINES = {}
+_ENGINES_LOCK = threading.Lock()
 
 def load_db_connections():
     connections = {}
@@ -16,20 +25,28 @@ def load_db_connections():
         password = os.getenv(f"DB_{idx}_PASSWORD")
         description = os.getenv(f"DB_{idx}_DESCRIPTION")
         tool_name = os.getenv(f"DB_{idx}_TOOL_NAME")
-        if username and password and tool_name:
+        if tool_name and (username and password or "sqlite:" in url):
             connections[tool_name] = {
                 "url": url,
                 "username": username,
                 "password": password,
-                "description": description
+                "description": description,
+                "pool_size": int(os.getenv(f"DB_{idx}_POOL_SIZE", str(DB_POOL_SIZE))),
+                "max_concurrency": int(os.getenv(f"DB_{idx}_MAX_CONCURRENCY", str(DB_MAX_CONCURRENCY))),
             }
         idx += 1
     return connections
 
 DB_CONNECTIONS = load_db_connections()
+DB_SLOTS = {tool_name: threading.BoundedSemaphore(conn["max_concurrency"]) for tool_name, conn in DB_CONNECTIONS.items()}
+
+QUERY_CACHE = OrderedDict()
+QUERY_CACHE_LOCK = threading.Lock()
 
 def _sqlalchemy_url(conn: dict) -> str:
     raw = (conn.get("url") or "").strip().removeprefix("jdbc:")
+    if raw.startswith("sqlite:"):
+        return f"sqlite:///{raw.removeprefix('sqlite:').removeprefix('//')}"
     if "://" not in raw:
         raw = "//" + raw
     parsed = urlparse(raw)
@@ -40,33 +57,72 @@ def _sqlalchemy_url(conn: dict) -> str:
     return f"{scheme}://{conn['username']}:{conn['password']}@{host}{port}/{db}"
 
 def get_engine(tool_name: str):
-    if tool_name in _ENGINES:
-        return _ENGINES[tool_name]
-    conn = DB_CONNECTIONS[tool_name]
-    url = _sqlalchemy_url(conn)
-    connect_args = {}
-    if url.startswith("postgresql"):
-        connect_args = {"options": "-c statement_timeout=30s"}
-    engine = create_engine(
-        url,
-        connect_args=connect_args,
-        pool_pre_ping=True,
-        pool_timeout=10,
-        pool_recycle=3600,
-    )
-    _ENGINES[tool_name] = engine
-    return engine
+    with _ENGINES_LOCK:
+        if tool_name in _ENGINES:
+            return _ENGINES[tool_name]
+        conn = DB_CONNECTIONS[tool_name]
+        url = _sqlalchemy_url(conn)
+        connect_args = {}
+        if url.startswith("postgresql"):
+            connect_args = {"options": "-c statement_timeout=30s"}
+        engine = create_engine(
+            url,
+            connect_args=connect_args,
+            pool_size=conn["pool_size"],
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_pre_ping=True,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=3600,
+        )
+        _ENGINES[tool_name] = engine
+        return engine
+
+def normalize_select(statement) -> str:
+    parts = []
+    for token in statement.flatten():
+        if token.is_whitespace:
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+            continue
+        parts.append(token.value.upper() if token.is_keyword else token.value)
+    return "".join(parts).strip().rstrip(";").strip()
+
+def cached_result(cache_key):
+    with QUERY_CACHE_LOCK:
+        entry = QUERY_CACHE.get(cache_key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        QUERY_CACHE.move_to_end(cache_key)
+        return entry[1]
+
+def cache_result(cache_key, result):
+    with QUERY_CACHE_LOCK:
+        QUERY_CACHE[cache_key] = (time.monotonic() + DB_CACHE_TTL_SECONDS, result)
+        QUERY_CACHE.move_to_end(cache_key)
+        while len(QUERY_CACHE) > DB_CACHE_SIZE:
+            QUERY_CACHE.popitem(last=False)
+
+def fetch_rows(tool_name, statement):
+    limited_select = f"SELECT * FROM ({str(statement).strip().rstrip(';')}) AS limited_rows LIMIT {DB_MAX_FETCH_ROWS + 1}"
+    with DB_SLOTS[tool_name], get_engine(tool_name).connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(text(limited_select))
+        rows = []
+        for batch in iter(lambda: result.fetchmany(DB_FETCH_BATCH), []):
+            rows.extend(dict(row._mapping) for row in batch)
+    return rows
 
 def db_query(tool_name, select):
-    parsed = sqlparse.parse(select.strip())
+    parsed = sqlparse.parse(sqlparse.format(select.strip(), strip_comments=True))
     if not parsed or parsed[0].get_type() != "SELECT":
         return {"error": "Разрешены только SELECT запросы", "rows": [], "select": select}
+    cache_key = (tool_name, normalize_select(parsed[0]))
+    result = cached_result(cache_key)
+    if result is not None:
+        return {**result, "select": select, "cached": True}
     try:
-        engine = get_engine(tool_name)
-        with engine.connect() as connection:
-            result = connection.execute(text(select))
-            rows = [dict(row._mapping) for row in result]
-        return {"rows": rows, "select": select}
+        rows = fetch_rows(tool_name, parsed[0])
     except Exception as e:
         return {"error": str(e), "rows": [], "select": select}
-
+    result = {"rows": rows[:DB_MAX_FETCH_ROWS], "complete": len(rows) <= DB_MAX_FETCH_ROWS}
+    cache_result(cache_key, result)
+    return {**result, "select": select}
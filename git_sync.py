@@ -0,0 +1,83 @@
+from pathlib import Path
+
+from utils import REPOS_ROOT, setup_logging, to_posix
+from mask import mask_path
+from scan import current_hash, find_git_roots, run_git
+from build import get_manifest_hash, get_repo_commit, move_file_data, set_repo_commit, sync_file
+from journal import defer_job
+from metrics import export_metrics
+from storage import STORAGE
+
+logger = setup_logging(Path(__file__).stem)
+
+EMPTY_TREE = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+
+def parse_name_status(output: str) -> list[tuple[str, str, str]]:
+    fields = output.split("\0")[:-1]
+    changes = []
+    idx = 0
+    while idx < len(fields):
+        status = fields[idx][0]
+        if status in "RC":
+            changes.append((status, fields[idx + 1], fields[idx + 2]))
+            idx += 3
+        else:
+            changes.append((status, fields[idx + 1], fields[idx + 1]))
+            idx += 2
+    return changes
+
+def sync_change(status: str, old_rel_path: str, new_rel_path: str):
+    if status == "R":
+        mask_path(old_rel_path)
+        mask_path(new_rel_path)
+        new_hash = current_hash(new_rel_path)
+        old_hash = get_manifest_hash(old_rel_path)
+        if new_hash and new_hash == old_hash:
+            move_file_data(old_rel_path, new_rel_path, new_hash)
+            return
+        sync_file(old_rel_path, None, old_hash)
+        sync_file(new_rel_path, new_hash, get_manifest_hash(new_rel_path))
+        return
+    mask_path(new_rel_path)
+    sync_file(new_rel_path, current_hash(new_rel_path), get_manifest_hash(new_rel_path))
+
+def defer_change(rel_path: str, error: str):
+    new_hash = current_hash(rel_path)
+    if new_hash:
+        defer_job(rel_path, new_hash, get_manifest_hash(rel_path), error)
+
+def sync_repo(git_root: Path):
+    repo = to_posix(git_root.relative_to(REPOS_ROOT))
+    head = run_git(git_root, ["rev-parse", "HEAD"]).strip()
+    last_commit = get_repo_commit(repo) or EMPTY_TREE
+    if last_commit == head:
+        logger.info(f"⏭️  {repo} unchanged at {head[:8]}")
+        return
+    changes = parse_name_status(run_git(git_root, ["diff", "--name-status", "-M", "-z", last_commit, head]))
+    logger.info(f"🌿 {repo}: {last_commit[:8]}..{head[:8]} → {len(changes)} changed files")
+    failed = 0
+    for status, old_path, new_path in changes:
+        old_rel_path = to_posix(f"{repo}/{old_path}")
+        new_rel_path = to_posix(f"{repo}/{new_path}")
+        try:
+            sync_change(status, old_rel_path, new_rel_path)
+        except Exception as e:
+            failed += 1
+            logger.error(f"❌ Failed to sync {status} {new_rel_path}: {e}")
+            defer_change(new_rel_path, str(e))
+    if failed:
+        logger.warning(f"⚠️  {repo}: {failed} files failed, handed over to the build journal for retries")
+    set_repo_commit(repo, head)
+
+def main():
+    logger.info(f"🚀 Starting git diff sync...")
+    try:
+        for git_root in find_git_roots(REPOS_ROOT):
+            sync_repo(git_root)
+        logger.info(f"✨ Git diff sync completed")
+    finally:
+        export_metrics("git_sync")
+        STORAGE.close()
+
+if __name__ == "__main__":
+    main()
@@ -7,15 +7,37 @@ create_indices() {
     sleep 1
   done
   
-  curl -fsS -X PUT "http://localhost:9200/${ES_INDEX_CHUNKS:-chunks}" \
+  case "${VECTOR_INDEX_TYPE:-hnsw}" in
+    hnsw|int8_hnsw) ;;
+    *)
+      echo "[elasticsearch] unsupported VECTOR_INDEX_TYPE=${VECTOR_INDEX_TYPE}, expected hnsw or int8_hnsw" >&2
+      return 1
+      ;;
+  esac
+
+  sed -e "s/\"dims\": 1024/\"dims\": ${EMBED_DIMS:-1024}/" \
+    -e "s/\"type\": \"hnsw\"/\"type\": \"${VECTOR_INDEX_TYPE:-hnsw}\"/" \
+    -e "s/\"m\": 32/\"m\": ${VECTOR_HNSW_M:-32}/" \
+    -e "s/\"ef_construction\": 256/\"ef_construction\": ${VECTOR_HNSW_EF_CONSTRUCTION:-256}/" \
+    /init/index_chunks.json > /tmp/index_chunks.json
+
+  chunks_response=$(curl -sS -X PUT "http://localhost:9200/${ES_INDEX_CHUNKS:-chunks}" \
     -H 'Content-Type: application/json' \
-    -d @/init/index_chunks.json >/dev/null 2>&1 || true
+    -d @/tmp/index_chunks.json 2>&1) || true
+  case "$chunks_response" in
+    *'"acknowledged":true'*|*resource_already_exists_exception*) ;;
+    *) echo "[elasticsearch] failed to create ${ES_INDEX_CHUNKS:-chunks} index: ${chunks_response}" >&2 ;;
+  esac
 
   curl -fsS -X PUT "http://localhost:9200/${ES_INDEX_FILE_MANIFEST:-file_manifest}" \
     -H 'Content-Type: application/json' \
     -d @/init/index_file_manifest.json >/dev/null 2>&1 || true
 
-  echo "[elasticsearch] indices applied (chunks, file_manifest)"
+  curl -fsS -X PUT "http://localhost:9200/${ES_INDEX_SYMBOLS:-symbols}" \
+    -H 'Content-Type: application/json' \
+    -d @/init/index_symbols.json >/dev/null 2>&1 || true
+
+  echo "[elasticsearch] indices applied (chunks, file_manifest, symbols)"
 }
 
 create_indices &
@@ -0,0 +1,126 @@
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+from utils import JOURNAL_FILE, JOURNAL_MAX_ATTEMPTS, JOURNAL_BACKOFF_SECONDS, in_subtrees, setup_logging
+
+logger = setup_logging(Path(__file__).stem)
+
+JOURNAL_FILE.parent.mkdir(parents=True, exist_ok=True)
+JOURNAL = sqlite3.connect(JOURNAL_FILE, isolation_level=None)
+JOURNAL.row_factory = sqlite3.Row
+JOURNAL.execute("PRAGMA journal_mode=WAL")
+JOURNAL.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        path TEXT PRIMARY KEY,
+        hash TEXT NOT NULL,
+        stored_hash TEXT,
+        state TEXT NOT NULL,
+        attempts INTEGER NOT NULL,
+        next_attempt_at REAL NOT NULL,
+        error TEXT,
+        payload TEXT,
+        duration REAL,
+        updated_at REAL NOT NULL
+    )
+""")
+
+ACTIVE_STATES = ("pending", "split", "embedded")
+
+def enqueue_job(rel_path, new_hash, stored_hash):
+    JOURNAL.execute("""
+        INSERT INTO jobs (path, hash, stored_hash, state, attempts, next_attempt_at, updated_at)
+        VALUES (?, ?, ?, 'pending', 0, 0, ?)
+        ON CONFLICT(path) DO UPDATE SET
+            hash = excluded.hash, stored_hash = excluded.stored_hash, state = 'pending', attempts = 0,
+            next_attempt_at = 0, error = NULL, payload = NULL, duration = NULL, updated_at = excluded.updated_at
+        WHERE jobs.hash != excluded.hash OR jobs.state = 'indexed'
+    """, (rel_path, new_hash, stored_hash, time.time()))
+
+def drop_jobs_except(planned_paths, subtrees):
+    stale_paths = [
+        row["path"] for row in JOURNAL.execute("SELECT path FROM jobs")
+        if row["path"] not in planned_paths and in_subtrees(row["path"], subtrees)
+    ]
+    JOURNAL.executemany("DELETE FROM jobs WHERE path = ?", [(p,) for p in stale_paths])
+    return len(stale_paths)
+
+def pending_jobs():
+    return JOURNAL.execute("SELECT * FROM jobs WHERE state = 'pending' ORDER BY path").fetchall()
+
+def next_due_job():
+    return JOURNAL.execute(
+        "SELECT * FROM jobs WHERE state IN (?, ?, ?) AND next_attempt_at <= ? ORDER BY next_attempt_at, path LIMIT 1",
+        (*ACTIVE_STATES, time.time())
+    ).fetchone()
+
+def next_retry_at():
+    return JOURNAL.execute("SELECT MIN(next_attempt_at) FROM jobs WHERE state IN (?, ?, ?)", ACTIVE_STATES).fetchone()[0]
+
+def advance_job(rel_path, state, payload):
+    JOURNAL.execute("UPDATE jobs SET state = ?, payload = ?, updated_at = ? WHERE path = ?", (state, payload, time.time(), rel_path))
+
+def complete_job(rel_path, duration):
+    JOURNAL.execute(
+        "UPDATE jobs SET state = 'indexed', payload = NULL, error = NULL, duration = ?, updated_at = ? WHERE path = ?",
+        (duration, time.time(), rel_path)
+    )
+
+def fail_job(rel_path, attempts, error):
+    now = time.time()
+    if attempts >= JOURNAL_MAX_ATTEMPTS:
+        JOURNAL.execute(
+            "UPDATE jobs SET state = 'failed', attempts = ?, error = ?, payload = NULL, updated_at = ? WHERE path = ?",
+            (attempts, error, now, rel_path)
+        )
+        logger.error(f"☠️  {rel_path} moved to dead letters after {attempts} attempts: {error}")
+        return
+    backoff = JOURNAL_BACKOFF_SECONDS * 2 ** (attempts - 1)
+    JOURNAL.execute(
+        "UPDATE jobs SET attempts = ?, error = ?, next_attempt_at = ?, updated_at = ? WHERE path = ?",
+        (attempts, error, now + backoff, now, rel_path)
+    )
+    logger.warning(f"🔁 {rel_path} attempt {attempts}/{JOURNAL_MAX_ATTEMPTS} failed, retry in {backoff:.0f}s: {error}")
+
+def defer_job(rel_path, new_hash, stored_hash, error):
+    enqueue_job(rel_path, new_hash, stored_hash)
+    attempts = JOURNAL.execute("SELECT attempts FROM jobs WHERE path = ?", (rel_path,)).fetchone()["attempts"]
+    fail_job(rel_path, attempts + 1, error)
+
+def retry_dead_letters():
+    return JOURNAL.execute(
+        "UPDATE jobs SET state = 'pending', attempts = 0, next_attempt_at = 0, error = NULL WHERE state = 'failed'"
+    ).rowcount
+
+def journal_status():
+    counts = {row["state"]: row["count"] for row in JOURNAL.execute("SELECT state, COUNT(*) AS count FROM jobs GROUP BY state")}
+    retrying = JOURNAL.execute("SELECT COUNT(*) FROM jobs WHERE state IN (?, ?, ?) AND error IS NOT NULL", ACTIVE_STATES).fetchone()[0]
+    avg_duration = JOURNAL.execute("SELECT AVG(duration) FROM jobs WHERE state = 'indexed'").fetchone()[0]
+    remaining = sum(counts.get(state, 0) for state in ACTIVE_STATES)
+    dead_letters = JOURNAL.execute("SELECT path, attempts, error FROM jobs WHERE state = 'failed' ORDER BY path").fetchall()
+    return {
+        "counts": counts,
+        "total": sum(counts.values()),
+        "remaining": remaining,
+        "retrying": retrying,
+        "eta_seconds": remaining * avg_duration if avg_duration else None,
+        "dead_letters": [dict(row) for row in dead_letters],
+    }
+
+def main():
+    if sys.argv[1:] == ["retry"]:
+        logger.info(f"🔁 Requeued {retry_dead_letters()} dead letters")
+        return
+    status = journal_status()
+    done = status["counts"].get("indexed", 0)
+    progress_pct = done / status["total"] * 100 if status["total"] else 100.0
+    eta = f"{status['eta_seconds'] / 60:.1f} min" if status["eta_seconds"] is not None else "n/a"
+    logger.info(f"📊 {done}/{status['total']} indexed ({progress_pct:.1f}%), remaining={status['remaining']}, "
+                f"retrying={status['retrying']}, failed={len(status['dead_letters'])}, ETA={eta}")
+    logger.info(f"📋 States: {status['counts']}")
+    for dead_letter in status["dead_letters"]:
+        logger.info(f"☠️  {dead_letter['path']} (attempts={dead_letter['attempts']}): {dead_letter['error']}")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
 from pathlib import Path
+import hashlib
+import os
 import re
-import shutil
 import tempfile
 from detect_secrets import SecretsCollection
 from detect_secrets.settings import default_settings
-from utils import clean_text, extract_binary_content, setup_logging, REPOS_ROOT, REPOS_SAFE_ROOT, is_ignored, to_posix
+from utils import clean_text, extract_binary_content, setup_logging, REPOS_ROOT, REPOS_SAFE_ROOT, MASK_RULES_FILE, SCAN_CACHE_FILE, is_ignored, to_posix
+from metrics import measure, export_metrics
 
 logger = setup_logging(Path(__file__).stem, file=False)
 
@@ -93,6 +95,11 @@ SECRET_PATTERNS = [
     *([(re.compile("|".join(map(re.escape, sorted(IGNORE_EXACT, key=len, reverse=True)))), "[REDACTED]")] if IGNORE_EXACT else []),
 ]
 
+MASK_RULES_HASH = hashlib.sha1(repr([
+    (pattern.pattern, pattern.flags, repl if isinstance(repl, str) else repl.__code__.co_consts)
+    for pattern, repl in SECRET_PATTERNS
+]).encode()).hexdigest()
+
 def check_secrets_in_text(text: str, file_path: str) -> None:
     with tempfile.NamedTemporaryFile(mode="w", delete=False, suffix=".txt", encoding="utf-8") as tmp:
         tmp.write(text)
@@ -119,37 +126,83 @@ def mask_secrets(text: str) -> str:
     return text
 
 
-def mask_directory(src_dir: Path, dst_dir: Path):
-    for item in (f for f in src_dir.rglob('**/*') if f.is_file()):
-        rel_path = to_posix(item.relative_to(src_dir))
-        if is_ignored(rel_path):
-            continue
-        dst_path = dst_dir / item.relative_to(src_dir)
-        dst_path.parent.mkdir(parents=True, exist_ok=True)
+def rules_changed() -> bool:
+    return not MASK_RULES_FILE.is_file() or MASK_RULES_FILE.read_text(encoding="utf-8") != MASK_RULES_HASH
+
+def save_rules_hash():
+    MASK_RULES_FILE.parent.mkdir(parents=True, exist_ok=True)
+    MASK_RULES_FILE.write_text(MASK_RULES_HASH, encoding="utf-8")
+
+def is_masked(src_path: Path, dst_path: Path) -> bool:
+    return dst_path.is_file() and dst_path.stat().st_mtime_ns == src_path.stat().st_mtime_ns
+
+def keep_source_mtime(src_path: Path, dst_path: Path):
+    src_stat = src_path.stat()
+    os.utime(dst_path, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+
+def mask_file(src_path: Path, dst_path: Path, rel_path: str):
+    dst_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        content = src_path.read_text(encoding='utf-8')
+        content = mask_secrets(content)
+        check_secrets_in_text(content, rel_path)
+        dst_path.write_text(content, encoding='utf-8')
+        keep_source_mtime(src_path, dst_path)
+        logger.debug(f"Маскирован: {rel_path}")
+    except UnicodeDecodeError:
         try:
-            content = item.read_text(encoding='utf-8')
+            content = extract_binary_content(src_path)
+            content = clean_text(content)
             content = mask_secrets(content)
             check_secrets_in_text(content, rel_path)
             dst_path.write_text(content, encoding='utf-8')
-            logger.debug(f"Маскирован: {rel_path}")
-        except UnicodeDecodeError:
-            try:
-                content = extract_binary_content(item)
-                content = clean_text(content)
-                content = mask_secrets(content)
-                check_secrets_in_text(content, rel_path)
-                dst_path.write_text(content, encoding='utf-8')
-                logger.debug(f"Бинарный файл распознан и маскирован: {rel_path}")
-            except Exception as e:
-                logger.error(f"Ошибка при обработке бинарного файла {rel_path}: {e}")
+            keep_source_mtime(src_path, dst_path)
+            logger.debug(f"Бинарный файл распознан и маскирован: {rel_path}")
         except Exception as e:
-            logger.error(f"Ошибка при обработке файла {rel_path}: {e}")
+            logger.error(f"Ошибка при обработке бинарного файла {rel_path}: {e}")
+    except Exception as e:
+        logger.error(f"Ошибка при обработке файла {rel_path}: {e}")
+
+def mask_directory(src_dir: Path, dst_dir: Path, force: bool):
+    skipped = 0
+    for item in (f for f in src_dir.rglob('**/*') if f.is_file()):
+        rel_path = to_posix(item.relative_to(src_dir))
+        if is_ignored(rel_path):
+            continue
+        dst_path = dst_dir / item.relative_to(src_dir)
+        if not force and is_masked(item, dst_path):
+            skipped += 1
+            continue
+        with measure("mask_file", {}):
+            mask_file(item, dst_path, rel_path)
+    logger.info(f"⏭️  Пропущено без изменений: {skipped}")
+
+def remove_stale(src_dir: Path, dst_dir: Path):
+    for item in (f for f in dst_dir.rglob('**/*') if f.is_file()):
+        rel_path = to_posix(item.relative_to(dst_dir))
+        if is_ignored(rel_path) or not (src_dir / item.relative_to(dst_dir)).is_file():
+            item.unlink()
+            logger.debug(f"Удалён устаревший: {rel_path}")
+
+def mask_path(rel_path: str):
+    src_path = REPOS_ROOT / rel_path
+    dst_path = REPOS_SAFE_ROOT / rel_path
+    if src_path.is_file() and not is_ignored(rel_path):
+        if rules_changed() or not is_masked(src_path, dst_path):
+            mask_file(src_path, dst_path, rel_path)
+    else:
+        dst_path.unlink(missing_ok=True)
 
 def main():
-    if REPOS_SAFE_ROOT.exists():
-        shutil.rmtree(REPOS_SAFE_ROOT)
-    REPOS_SAFE_ROOT.mkdir()
-    mask_directory(REPOS_ROOT, REPOS_SAFE_ROOT)
+    REPOS_SAFE_ROOT.mkdir(exist_ok=True)
+    remove_stale(REPOS_ROOT, REPOS_SAFE_ROOT)
+    force = rules_changed()
+    if force:
+        logger.info(f"🔐 Правила маскирования изменились ({MASK_RULES_HASH[:8]}), маскирую все файлы заново")
+        SCAN_CACHE_FILE.unlink(missing_ok=True)
+    mask_directory(REPOS_ROOT, REPOS_SAFE_ROOT, force)
+    save_rules_hash()
+    export_metrics("mask")
     logger.info(f"Маскирование завершено: {REPOS_SAFE_ROOT}")
 
 if __name__ == "__main__":
@@ -0,0 +1,140 @@
+import contextvars
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from utils import METRICS_DIR, TRACE_FILE, TRACING_ENABLED, setup_logging
+
+logger = setup_logging(Path(__file__).stem)
+
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+METRICS_LOCK = threading.Lock()
+COUNTERS = {}
+GAUGES = {}
+HISTOGRAMS = {}
+
+TRACE_LOCK = threading.Lock()
+EXPORT_LOCK = threading.Lock()
+CURRENT_SPAN = contextvars.ContextVar("current_span", default=None)
+
+if TRACING_ENABLED:
+    TRACE_FILE.parent.mkdir(parents=True, exist_ok=True)
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def inc(name, labels, amount):
+    key = (name, label_key(labels))
+    with METRICS_LOCK:
+        COUNTERS[key] = COUNTERS.get(key, 0) + amount
+
+def set_gauge(name, labels, value):
+    with METRICS_LOCK:
+        GAUGES[(name, label_key(labels))] = value
+
+def observe(name, labels, value):
+    key = (name, label_key(labels))
+    with METRICS_LOCK:
+        histogram = HISTOGRAMS.setdefault(key, {"buckets": [0] * len(HISTOGRAM_BUCKETS), "sum": 0.0, "count": 0})
+        for idx, bound in enumerate(HISTOGRAM_BUCKETS):
+            if value <= bound:
+                histogram["buckets"][idx] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+def open_span(name, labels, parent):
+    return {
+        "trace_id": parent["trace_id"] if parent else uuid.uuid4().hex,
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": parent["span_id"] if parent else None,
+        "name": name,
+        "labels": labels,
+        "start": time.time(),
+        "started": time.perf_counter(),
+    }
+
+def close_span(span, status):
+    duration = time.perf_counter() - span["started"]
+    observe(f"{span['name']}_seconds", span["labels"], duration)
+    inc(f"{span['name']}_total", {**span["labels"], "status": status}, 1)
+    if TRACING_ENABLED:
+        record = {k: v for k, v in span.items() if k != "started"}
+        with TRACE_LOCK, open(TRACE_FILE, "a", encoding="utf-8") as trace_file:
+            trace_file.write(json.dumps({**record, "duration": duration, "status": status}, ensure_ascii=False) + "\n")
+
+def span_context(span):
+    context = contextvars.copy_context()
+    context.run(CURRENT_SPAN.set, span)
+    return context
+
+@contextmanager
+def measure(name, labels):
+    span = open_span(name, labels, CURRENT_SPAN.get())
+    token = CURRENT_SPAN.set(span)
+    status = "error"
+    try:
+        yield span
+        status = "ok"
+    finally:
+        CURRENT_SPAN.reset(token)
+        close_span(span, status)
+
+def format_labels(label_items):
+    if not label_items:
+        return ""
+    escaped = [f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in label_items]
+    return "{" + ",".join(escaped) + "}"
+
+def render_metrics():
+    lines = []
+    with METRICS_LOCK:
+        for metric_type, values in (("counter", COUNTERS), ("gauge", GAUGES)):
+            typed_names = set()
+            for (name, label_items), value in sorted(values.items()):
+                if name not in typed_names:
+                    lines.append(f"# TYPE {name} {metric_type}")
+                    typed_names.add(name)
+                lines.append(f"{name}{format_labels(label_items)} {value}")
+        typed_names = set()
+        for (name, label_items), histogram in sorted(HISTOGRAMS.items()):
+            if name not in typed_names:
+                lines.append(f"# TYPE {name} histogram")
+                typed_names.add(name)
+            for bound, count in zip(HISTOGRAM_BUCKETS, histogram["buckets"]):
+                lines.append(f"{name}_bucket{format_labels((*label_items, ('le', bound)))} {count}")
+            lines.append(f"{name}_bucket{format_labels((*label_items, ('le', '+Inf')))} {histogram['count']}")
+            lines.append(f"{name}_sum{format_labels(label_items)} {histogram['sum']}")
+            lines.append(f"{name}_count{format_labels(label_items)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+def start_metrics_server(port):
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"📈 Metrics at http://0.0.0.0:{port}/metrics")
+
+def export_metrics(name):
+    METRICS_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_file = METRICS_DIR / f"{name}.prom.tmp"
+    with EXPORT_LOCK:
+        tmp_file.write_text(render_metrics(), encoding="utf-8")
+        tmp_file.replace(METRICS_DIR / f"{name}.prom")
@@ -0,0 +1,104 @@
+import json
+import threading
+import uuid
+from collections import OrderedDict
+
+from utils import RESULT_MAX_CHARS, RESULT_MAX_TOKENS, RESULT_MAX_ROWS, RESULT_STORE_SIZE, CHARS_PER_TOKEN
+
+RESULT_BUDGET_CHARS = min(RESULT_MAX_CHARS, RESULT_MAX_TOKENS * CHARS_PER_TOKEN)
+
+RESULT_STORE = OrderedDict()
+RESULT_STORE_LOCK = threading.Lock()
+
+def store_result(kind, items):
+    result_id = uuid.uuid4().hex[:12]
+    with RESULT_STORE_LOCK:
+        RESULT_STORE[result_id] = (kind, items)
+        while len(RESULT_STORE) > RESULT_STORE_SIZE:
+            RESULT_STORE.popitem(last=False)
+    return result_id
+
+def row_text(row):
+    return json.dumps(row, ensure_ascii=False, default=str)
+
+def clip_text(text, max_chars):
+    return text if len(text) <= max_chars else text[:max_chars - 1] + "…"
+
+def fit_within_budget(items, item_texts, max_items, budget_chars):
+    shown_items = []
+    clipped = 0
+    used_chars = 0
+    for item, item_text in zip(items[:max_items], item_texts):
+        shown_text = clip_text(item_text, budget_chars - 1)
+        used_chars += len(shown_text) + 1
+        if used_chars > budget_chars:
+            break
+        if shown_text != item_text:
+            item = shown_text
+            clipped += 1
+        shown_items.append(item)
+    return shown_items, clipped
+
+def shape_command_result(result):
+    stdout = result["stdout"]
+    if len(stdout) <= RESULT_BUDGET_CHARS:
+        return result
+    lines = stdout.split("\n")
+    half_budget = RESULT_BUDGET_CHARS // 2
+    head_lines, head_clipped = fit_within_budget(lines, lines, len(lines), half_budget)
+    tail_lines, tail_clipped = fit_within_budget(lines[::-1], lines[::-1], len(lines) - len(head_lines), half_budget)
+    return {
+        "stdout_head": "\n".join(head_lines),
+        "stdout_tail": "\n".join(tail_lines[::-1]),
+        "omitted_lines": len(lines) - len(head_lines) - len(tail_lines),
+        "clipped_lines": head_clipped + tail_clipped,
+        "total_lines": len(lines),
+        "total_chars": len(stdout),
+        "result_id": store_result("lines", lines),
+        "exit_code": result["exit_code"],
+        "truncated": result["truncated"],
+    }
+
+def shape_rows(result):
+    if "error" in result:
+        return result
+    rows = result["rows"][:RESULT_MAX_ROWS]
+    shown_rows, clipped = fit_within_budget(rows, [row_text(row) for row in rows], RESULT_MAX_ROWS, RESULT_BUDGET_CHARS)
+    if len(shown_rows) == len(result["rows"]) and not clipped:
+        return result
+    return {
+        "rows": shown_rows,
+        "shown_rows": len(shown_rows),
+        "clipped_rows": clipped,
+        "row_count": len(result["rows"]),
+        "row_count_complete": result["complete"],
+        "result_id": store_result("rows", result["rows"]),
+        "select": result["select"],
+    }
+
+def read_result_page(result_id, offset, char_offset, limit):
+    with RESULT_STORE_LOCK:
+        if result_id not in RESULT_STORE:
+            return {"error": f"Результат {result_id} не найден или вытеснен, повтори исходный запрос"}
+        kind, items = RESULT_STORE[result_id]
+    page = items[offset:offset + limit]
+    item_texts = page if kind == "lines" else [row_text(row) for row in page]
+    if char_offset and page:
+        item_texts = [item_texts[0][char_offset:], *item_texts[1:]]
+        page = [item_texts[0], *page[1:]]
+    shown_items, clipped = fit_within_budget(page, item_texts, limit, RESULT_BUDGET_CHARS)
+    next_offset = offset + len(shown_items)
+    next_char_offset = 0
+    if clipped:
+        next_offset = offset
+        next_char_offset = char_offset + len(shown_items[0]) - 1
+    return {
+        kind: shown_items,
+        f"clipped_{kind}": clipped,
+        "offset": offset,
+        "char_offset": char_offset,
+        "next_offset": next_offset if next_offset < len(items) else None,
+        "next_char_offset": next_char_offset,
+        "total": len(items),
+        "result_id": result_id,
+    }
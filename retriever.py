@@ -2,27 +2,29 @@ from typing import List
 from pathlib import Path
 
 import torch
-from elasticsearch import Elasticsearch
 from llama_index.core.schema import QueryBundle, BaseNode, TextNode, NodeWithScore
 from llama_index.core import Settings
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.postprocessor.sbert_rerank import SentenceTransformerRerank
 
-from utils import ES_URL, ES_INDEX_CHUNKS, EMBED_MODEL, RERANK_MODEL, setup_logging, to_posix
+from utils import (
+    EMBED_MODEL, RERANK_MODEL, EMBED_DIMS, KNN_NUM_CANDIDATES_FACTOR, compact_vector, setup_logging, to_posix
+)
+from metrics import measure
+from storage import STORAGE, SOURCE_FIELDS
 
 logger = setup_logging(Path(__file__).stem)
 
-ES = Elasticsearch(ES_URL, request_timeout=30, max_retries=3, retry_on_timeout=True)
-
 Settings.embed_model = HuggingFaceEmbedding(EMBED_MODEL, normalize=True)
 embedding_dim = len(Settings.embed_model.get_text_embedding("test"))
-if embedding_dim != 1024:
-    raise ValueError(f"Несоответствие размерности эмбеддинга: модель {EMBED_MODEL} возвращает {embedding_dim}, а ES настроен на 1024. Измените dims в images/elasticsearch/index_chunks.json или используйте модель с размерностью 1024.")
+if embedding_dim < EMBED_DIMS:
+    raise ValueError(f"Несоответствие размерности эмбеддинга: модель {EMBED_MODEL} возвращает {embedding_dim}, а EMBED_DIMS={EMBED_DIMS}. Уменьшите EMBED_DIMS (и пересоздайте индекс) или используйте модель с большей размерностью.")
 
-DEVICE = "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu"
-RERANKER = SentenceTransformerRerank(model=RERANK_MODEL, top_n=10, device=DEVICE)
+KNN_MAX_NUM_CANDIDATES = 10000
 
-SOURCE_FIELDS = ["text", "path", "start_line", "end_line", "title", "symbols", "lang", "mime", "file_lines", "kind", "chunk_id", "chunks"]
+DEVICE = "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu"
+RERANK_TOP_N_LIMIT = 60
+RERANKER = SentenceTransformerRerank(model=RERANK_MODEL, top_n=RERANK_TOP_N_LIMIT, device=DEVICE)
 
 def rrf_fusion(ranked_lists, k=60):
     pos = [{d: i for i, d in enumerate(lst)} for lst in ranked_lists]
@@ -34,28 +36,21 @@ def retrieve_fusion_nodes(question: str, path_prefix: str, top_n: int, symbols,
     shortlist = max(6 * top_n, 32) if use_reranker else top_n
     cleaned = path_prefix.replace("*", "") if path_prefix else ""
     normalized = to_posix(cleaned) if cleaned else ""
-    path_filter = [{"prefix": {"path": normalized}}] if normalized else []
-    should_clauses = [{"multi_match": {"query": question, "fields": ["text^1.0", "text.ru^1.3", "text.en^1.2"]}}]
-    if symbols:
-        should_clauses.append({"terms": {"symbols": [s.lower() for s in symbols if s]}})
-    bm25_response = ES.search(
-        index=ES_INDEX_CHUNKS,
-        body={"size": shortlist, "query": {"bool": {"filter": path_filter, "should": should_clauses, "minimum_should_match": 1}}, "_source": {"includes": SOURCE_FIELDS}}
-    )
-    bm25_hits = {hit["_id"]: hit for hit in bm25_response["hits"]["hits"]}
-    query_embedding = Settings.embed_model.get_text_embedding(question)
-    knn_config = {"field": "embedding", "query_vector": query_embedding, "k": shortlist, "num_candidates": shortlist * 4}
-    if path_filter:
-        knn_config["filter"] = {"bool": {"must": path_filter}}
-    knn_response = ES.search(index=ES_INDEX_CHUNKS, body={"size": shortlist, "knn": knn_config, "_source": {"includes": SOURCE_FIELDS}})
-    knn_hits = {hit["_id"]: hit for hit in knn_response["hits"]["hits"]}
+    with measure("search_stage", {"stage": "bm25"}):
+        bm25_hits = {hit["_id"]: hit for hit in STORAGE.text_search(question, normalized, symbols, shortlist)}
+    with measure("search_stage", {"stage": "embed_query"}):
+        query_embedding = compact_vector(Settings.embed_model.get_text_embedding(question))
+    num_candidates = min(int(shortlist * KNN_NUM_CANDIDATES_FACTOR), KNN_MAX_NUM_CANDIDATES)
+    with measure("search_stage", {"stage": "knn"}):
+        knn_hits = {hit["_id"]: hit for hit in STORAGE.vector_search(query_embedding, normalized, shortlist, num_candidates)}
     fused_ids = rrf_fusion([bm25_hits.keys(), knn_hits.keys()])[:shortlist]
     all_hits = {**bm25_hits, **knn_hits}
     candidates = [NodeWithScore(node=TextNode(id_=doc_id, text=all_hits[doc_id]["_source"]["text"], metadata=dict(all_hits[doc_id]["_source"])), score=0.0) for doc_id in fused_ids]
     logger.info(f"🔗 RRF: bm25={len(bm25_hits)} knn={len(knn_hits)} → shortlist={len(candidates)}")
     if use_reranker and candidates:
-        RERANKER.top_n = top_n
-        result = [nws.node for nws in RERANKER.postprocess_nodes(candidates, query_bundle=QueryBundle(query_str=question))]
+        with measure("search_stage", {"stage": "rerank"}):
+            reranked = RERANKER.postprocess_nodes(candidates, query_bundle=QueryBundle(query_str=question))
+        result = [nws.node for nws in reranked[:top_n]]
         logger.info(f"✨ top_n={top_n} → returned={len(result)} (⭐ reranked)")
         return result
     result = [nws.node for nws in candidates[:top_n]]
@@ -65,6 +60,70 @@ def retrieve_fusion_nodes(question: str, path_prefix: str, top_n: int, symbols,
 def format_chunk_data(doc_id, metadata):
     return {"id": doc_id, **{k: v for k, v in metadata.items() if k in SOURCE_FIELDS}}
 
-def main_search(question: str, path_prefix: str, top_n: int, symbols, use_reranker):
-    nodes = retrieve_fusion_nodes(question, path_prefix, top_n, symbols, use_reranker)
-    return [format_chunk_data(node.id_, node.metadata) for node in nodes]
+def neighbor_ids(nodes, neighbors):
+    hit_ids = {node.id_ for node in nodes}
+    doc_ids = []
+    for node in nodes:
+        metadata = node.metadata
+        for chunk_id in range(metadata["chunk_id"] - neighbors, metadata["chunk_id"] + neighbors + 1):
+            doc_id = f"{metadata['path']}#{chunk_id}/{metadata['chunks']}"
+            if 1 <= chunk_id <= metadata["chunks"] and doc_id not in hit_ids and doc_id not in doc_ids:
+                doc_ids.append(doc_id)
+    return doc_ids
+
+def fetch_chunks(doc_ids):
+    if not doc_ids:
+        return {}
+    return STORAGE.get_chunks(doc_ids)
+
+def merge_spans(chunk_by_id, rank_by_id):
+    entries_by_path = {}
+    for doc_id, chunk in chunk_by_id.items():
+        entries_by_path.setdefault(chunk["path"], []).append((doc_id, chunk))
+    spans = []
+    for path, entries in entries_by_path.items():
+        entries.sort(key=lambda entry: entry[1]["chunk_id"])
+        for doc_id, chunk in entries:
+            if not spans or spans[-1]["path"] != path or spans[-1]["chunk_ids"][-1] + 1 != chunk["chunk_id"]:
+                spans.append({
+                    "path": path, "lang": chunk["lang"], "file_lines": chunk["file_lines"],
+                    "start_line": chunk["start_line"], "chunk_ids": [], "hit_chunk_ids": [], "best_rank": None,
+                    "titles": [], "symbols": [], "texts": [],
+                })
+            span = spans[-1]
+            span["end_line"] = chunk["end_line"]
+            span["chunk_ids"].append(chunk["chunk_id"])
+            span["titles"].append(chunk["title"])
+            span["symbols"].extend(chunk["symbols"])
+            span["texts"].append(chunk["text"])
+            if doc_id in rank_by_id:
+                span["hit_chunk_ids"].append(chunk["chunk_id"])
+                span["best_rank"] = min(rank_by_id[doc_id], span["best_rank"] or rank_by_id[doc_id])
+    for span in spans:
+        span["symbols"] = list(dict.fromkeys(span["symbols"]))
+        span["text"] = "\n".join(span.pop("texts"))
+    return sorted(spans, key=lambda span: (span["best_rank"] is None, span["best_rank"] or 0))
+
+def group_spans(spans):
+    groups = {}
+    for span in spans:
+        group = groups.setdefault(span["path"], {
+            "path": span["path"], "lang": span["lang"], "file_lines": span["file_lines"],
+            "best_rank": span["best_rank"], "hits": 0, "spans": [],
+        })
+        group["hits"] += len(span["hit_chunk_ids"])
+        group["spans"].append({k: v for k, v in span.items() if k not in ("path", "lang", "file_lines")})
+    return list(groups.values())
+
+def main_search(question: str, path_prefix: str, top_n: int, symbols, use_reranker, neighbors: int, group_by_file: bool):
+    with measure("search", {"reranked": str(bool(use_reranker)).lower()}):
+        nodes = retrieve_fusion_nodes(question, path_prefix, top_n, symbols, use_reranker)
+    if not neighbors and not group_by_file:
+        return [format_chunk_data(node.id_, node.metadata) for node in nodes]
+    rank_by_id = {node.id_: rank for rank, node in enumerate(nodes, start=1)}
+    chunk_by_id = {node.id_: node.metadata for node in nodes}
+    with measure("search_stage", {"stage": "expand"}):
+        chunk_by_id.update(fetch_chunks(neighbor_ids(nodes, neighbors)))
+    spans = merge_spans(chunk_by_id, rank_by_id)
+    logger.info(f"🧩 Expanded {len(nodes)} hits by ±{neighbors} → {len(chunk_by_id)} chunks in {len(spans)} spans")
+    return group_spans(spans) if group_by_file else spans
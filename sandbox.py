@@ -0,0 +1,99 @@
+import functools
+import queue
+import shlex
+import subprocess
+import threading
+import uuid
+from pathlib import Path
+
+from utils import (
+    REPOS_SAFE_ROOT, SANDBOX_CONTAINER_NAME, SANDBOX_RUNNER, SANDBOX_RUNNERS,
+    SANDBOX_COMMAND_TIMEOUT, SANDBOX_KILL_GRACE_SECONDS, SANDBOX_OUTPUT_LIMIT_BYTES, setup_logging
+)
+
+logger = setup_logging(Path(__file__).stem)
+
+READ_CHUNK_BYTES = 65536
+READ_DEADLINE_SECONDS = SANDBOX_COMMAND_TIMEOUT + 2 * SANDBOX_KILL_GRACE_SECONDS
+
+IDLE_RUNNERS = queue.LifoQueue()
+RUNNER_SLOTS = threading.BoundedSemaphore(SANDBOX_RUNNERS)
+
+@functools.cache
+def sandbox_container_id() -> str:
+    ps_cmd = ['docker', 'ps', '--filter', f'name={SANDBOX_CONTAINER_NAME}', '--format', '{{.ID}}']
+    ps_result = subprocess.run(ps_cmd, capture_output=True, text=True)
+    if ps_result.returncode != 0 or not ps_result.stdout.strip():
+        raise RuntimeError(f"Контейнер {SANDBOX_CONTAINER_NAME} не найден")
+    return ps_result.stdout.strip()
+
+def runner_argv() -> list[str]:
+    if SANDBOX_RUNNER == "local":
+        return ["sh"]
+    return ['docker', 'exec', '-i', '-u', 'nobody', sandbox_container_id(), 'sh']
+
+def start_runner() -> subprocess.Popen:
+    runner = subprocess.Popen(runner_argv(), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, cwd=REPOS_SAFE_ROOT)
+    logger.info(f"🐚 Started {SANDBOX_RUNNER} sandbox runner pid={runner.pid}")
+    return runner
+
+def acquire_runner() -> subprocess.Popen:
+    RUNNER_SLOTS.acquire()
+    while not IDLE_RUNNERS.empty():
+        runner = IDLE_RUNNERS.get_nowait()
+        if runner.poll() is None:
+            return runner
+    try:
+        return start_runner()
+    except Exception:
+        RUNNER_SLOTS.release()
+        raise
+
+def release_runner(runner: subprocess.Popen, healthy: bool):
+    if healthy:
+        IDLE_RUNNERS.put(runner)
+    else:
+        runner.kill()
+        sandbox_container_id.cache_clear()
+    RUNNER_SLOTS.release()
+
+def run_in_runner(runner: subprocess.Popen, command: str) -> dict:
+    marker = f"__rag_sandbox_{uuid.uuid4().hex}__".encode()
+    script = (
+        f"timeout -k {SANDBOX_KILL_GRACE_SECONDS} {SANDBOX_COMMAND_TIMEOUT} sh -c {shlex.quote(command)} </dev/null 2>/dev/null; "
+        f"printf '\\n%s %s\\n' {marker.decode()} \"$?\"\n"
+    )
+    deadline = threading.Timer(READ_DEADLINE_SECONDS, runner.kill)
+    deadline.start()
+    try:
+        runner.stdin.write(script.encode())
+        runner.stdin.flush()
+        return read_runner_output(runner, marker)
+    finally:
+        deadline.cancel()
+
+def read_runner_output(runner: subprocess.Popen, marker: bytes) -> dict:
+    chunks = []
+    size = 0
+    truncated = False
+    while True:
+        line = runner.stdout.readline(READ_CHUNK_BYTES)
+        if not line:
+            raise RuntimeError(f"Sandbox runner завершился или не ответил за {READ_DEADLINE_SECONDS}s во время выполнения команды")
+        if line.startswith(marker):
+            stdout = b"".join(chunks).removesuffix(b"\n").decode("utf-8", errors="replace")
+            return {"stdout": stdout, "exit_code": int(line.split()[1]), "truncated": truncated}
+        kept = line[:SANDBOX_OUTPUT_LIMIT_BYTES - size]
+        chunks.append(kept)
+        size += len(kept)
+        truncated = truncated or len(kept) < len(line)
+
+def execute_command(command: str):
+    runner = acquire_runner()
+    healthy = False
+    try:
+        result = run_in_runner(runner, command)
+        healthy = True
+        return result
+    finally:
+        release_runner(runner, healthy)
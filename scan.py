@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from utils import MASK_RULES_FILE, REPOS_ROOT, REPOS_SAFE_ROOT, SCAN_GIT_OIDS, SCAN_WORKERS, git_blob_oid, in_subtrees, is_ignored, setup_logging, to_posix
+
+logger = setup_logging(Path(__file__).stem)
+
+def walk_files(root: Path):
+    for dir_path, _, file_names in os.walk(root):
+        for file_name in file_names:
+            yield Path(dir_path) / file_name
+
+def load_stat_cache(cache_file: Path) -> dict:
+    if not cache_file.exists():
+        return {}
+    return json.loads(cache_file.read_text(encoding="utf-8"))
+
+def save_stat_cache(cache_file: Path, stat_cache: dict):
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_suffix(".tmp")
+    tmp_file.write_text(json.dumps(stat_cache, separators=(",", ":")), encoding="utf-8")
+    tmp_file.replace(cache_file)
+
+def run_git(git_root: Path, args: list[str]) -> str:
+    return subprocess.run(["git", "-C", str(git_root), *args], capture_output=True, text=True, check=True).stdout
+
+def mask_rules_hash() -> str:
+    return MASK_RULES_FILE.read_text(encoding="utf-8") if MASK_RULES_FILE.is_file() else ""
+
+def masked_oid(oid: str, rules_hash: str) -> str:
+    return hashlib.sha1(f"{oid}:{rules_hash}".encode()).hexdigest()
+
+def find_git_roots(repos_root: Path) -> list[Path]:
+    return [d for d in [repos_root, *repos_root.iterdir()] if (d / ".git").exists()]
+
+def load_git_oids(repos_root: Path) -> dict:
+    git_roots = find_git_roots(repos_root)
+    rules_hash = mask_rules_hash()
+    oid_by_file = {}
+    for git_root in git_roots:
+        prefix = to_posix(git_root.relative_to(repos_root))
+        modified = set(run_git(git_root, ["ls-files", "-m", "-z"]).split("\0"))
+        for entry in run_git(git_root, ["ls-files", "-s", "-z"]).split("\0"):
+            if not entry:
+                continue
+            meta, rel_path = entry.split("\t", 1)
+            if rel_path in modified:
+                continue
+            oid_by_file[to_posix(f"{prefix}/{rel_path}")] = masked_oid(meta.split()[1], rules_hash)
+    logger.info(f"🌿 Loaded {len(oid_by_file)} blob OIDs from {len(git_roots)} git checkouts")
+    return oid_by_file
+
+def path_git_oids(rel_path: str) -> dict:
+    full_path = REPOS_ROOT / rel_path
+    for git_root in sorted(find_git_roots(REPOS_ROOT), key=lambda d: len(d.parts), reverse=True):
+        if not full_path.is_relative_to(git_root):
+            continue
+        inner_path = to_posix(full_path.relative_to(git_root))
+        if run_git(git_root, ["ls-files", "-m", "-z", "--", inner_path]):
+            return {}
+        entry = run_git(git_root, ["ls-files", "-s", "-z", "--", inner_path]).split("\0")[0]
+        return {rel_path: masked_oid(entry.split("\t", 1)[0].split()[1], mask_rules_hash())} if entry else {}
+    return {}
+
+def file_hash(root: Path, rel_path: str, oid_by_file: dict) -> str | None:
+    safe_path = root / rel_path
+    if is_ignored(rel_path) or not safe_path.is_file():
+        return None
+    if rel_path in oid_by_file:
+        return oid_by_file[rel_path]
+    return git_blob_oid(safe_path)
+
+def current_hash(rel_path: str) -> str | None:
+    return file_hash(REPOS_SAFE_ROOT, rel_path, path_git_oids(rel_path) if SCAN_GIT_OIDS else {})
+
+def scan_hashes(root: Path, cache_file: Path, oid_by_file: dict, subtrees: list[str]) -> dict:
+    stat_cache = load_stat_cache(cache_file)
+    next_stat_cache = {p: cached for p, cached in stat_cache.items() if not in_subtrees(p, subtrees)}
+    hash_by_file = {}
+    stat_by_file = {}
+    git_count = 0
+    cached_count = 0
+    scan_roots = [root / subtree for subtree in subtrees] if subtrees else [root]
+    for full in (f for scan_root in scan_roots for f in walk_files(scan_root)):
+        rel_path = to_posix(full.relative_to(root))
+        hash_by_file[rel_path] = None
+        if is_ignored(rel_path):
+            continue
+        if rel_path in oid_by_file:
+            hash_by_file[rel_path] = file_hash(root, rel_path, oid_by_file)
+            git_count += 1
+            continue
+        st = full.stat()
+        file_stat = [st.st_size, st.st_mtime_ns, st.st_ino]
+        cached = stat_cache.get(rel_path)
+        if cached and cached[:3] == file_stat:
+            hash_by_file[rel_path] = cached[3]
+            next_stat_cache[rel_path] = cached
+            cached_count += 1
+            continue
+        stat_by_file[rel_path] = file_stat
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as pool:
+        oids = pool.map(lambda rel_path: file_hash(root, rel_path, oid_by_file), list(stat_by_file))
+        for (rel_path, file_stat), oid in zip(stat_by_file.items(), oids):
+            hash_by_file[rel_path] = oid
+            next_stat_cache[rel_path] = [*file_stat, oid]
+    save_stat_cache(cache_file, next_stat_cache)
+    logger.info(f"🔍 Scanned {len(hash_by_file)} files: hashed={len(stat_by_file)}, "
+                f"stat_cache={cached_count}, git={git_count}")
+    return hash_by_file
@@ -0,0 +1,335 @@
+import json
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from elasticsearch import Elasticsearch, helpers
+
+from utils import (
+    ES_URL, ES_INDEX_CHUNKS, ES_INDEX_FILE_MANIFEST, ES_INDEX_SYMBOLS, EMBED_DIMS,
+    SEARCH_BACKEND, LOCAL_INDEX_DIR, MANIFEST_PAGE_SIZE, MANIFEST_SLICES, MANIFEST_SNAPSHOT_FILE,
+    in_subtrees, setup_logging
+)
+from symbols import symbol_actions
+
+logger = setup_logging(Path(__file__).stem)
+
+SOURCE_FIELDS = ["text", "path", "start_line", "end_line", "title", "symbols", "lang", "mime", "file_lines", "kind", "chunk_id", "chunks"]
+
+SYMBOL_MATCH_SCORE = 1.0
+VECTOR_BLOCK_ROWS = 8192
+WORD_PATTERN = re.compile(r"\w+")
+WORD_PART_PATTERN = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+MANIFEST_PIT_KEEP_ALIVE = "2m"
+
+def manifest_query(path_prefixes):
+    query = {"bool": {"must_not": {"exists": {"field": "commit"}}}}
+    if path_prefixes:
+        query["bool"]["filter"] = [{"bool": {"should": [{"prefix": {"path": p}} for p in path_prefixes], "minimum_should_match": 1}}]
+    return query
+
+def load_manifest_snapshot(snapshot_file):
+    if not snapshot_file.exists():
+        return None
+    return json.loads(snapshot_file.read_text(encoding="utf-8"))
+
+def save_manifest_snapshot(snapshot_file, state, manifest):
+    snapshot_file.parent.mkdir(parents=True, exist_ok=True)
+    paths = sorted(manifest)
+    tmp_file = snapshot_file.with_suffix(".tmp")
+    tmp_file.write_text(json.dumps({"state": state, "paths": paths, "hashes": [manifest[p] for p in paths]}, separators=(",", ":")), encoding="utf-8")
+    tmp_file.replace(snapshot_file)
+
+class ElasticStorage:
+    def __init__(self):
+        self.es = Elasticsearch(ES_URL, request_timeout=30, max_retries=3, retry_on_timeout=True)
+
+    def delete_file(self, rel_path):
+        deleted = {}
+        for name, index in (("chunks", ES_INDEX_CHUNKS), ("manifest", ES_INDEX_FILE_MANIFEST), ("symbols", ES_INDEX_SYMBOLS)):
+            result = self.es.options(request_timeout=120).delete_by_query(
+                index=index,
+                body={"query": {"term": {"path": rel_path}}},
+                conflicts="proceed",
+                refresh=True,
+                allow_no_indices=True
+            )
+            deleted[name] = result.get("deleted", 0)
+        return deleted
+
+    def write_file(self, chunks, manifest):
+        helpers.bulk(self.es.options(request_timeout=120), chunks, chunk_size=2000, raise_on_error=True)
+        helpers.bulk(self.es.options(request_timeout=120), symbol_actions(chunks), chunk_size=2000, raise_on_error=True)
+        helpers.bulk(self.es.options(request_timeout=120), [manifest], chunk_size=1, raise_on_error=True)
+
+    def file_chunks(self, rel_path):
+        return [hit["_source"] for hit in helpers.scan(self.es, index=ES_INDEX_CHUNKS, query={"query": {"term": {"path": rel_path}}})]
+
+    def get_commit(self, repo):
+        response = self.es.options(ignore_status=404).get(index=ES_INDEX_FILE_MANIFEST, id=f"commit:{repo}", source_includes=["commit"])
+        return response["_source"]["commit"] if response["found"] else None
+
+    def set_commit(self, repo, document):
+        self.es.index(index=ES_INDEX_FILE_MANIFEST, id=f"commit:{repo}", document=document)
+
+    def manifest_state(self):
+        response = self.es.search(
+            index=ES_INDEX_FILE_MANIFEST, query=manifest_query([]), size=0, track_total_hits=True,
+            aggs={"updated_at": {"max": {"field": "updated_at"}}}
+        )
+        return [response["hits"]["total"]["value"], response["aggregations"]["updated_at"]["value"]]
+
+    def manifest_slice(self, pit_id, query, slice_id):
+        result = {}
+        search_after = None
+        while True:
+            response = self.es.search(
+                pit={"id": pit_id, "keep_alive": MANIFEST_PIT_KEEP_ALIVE},
+                slice={"id": slice_id, "max": MANIFEST_SLICES} if MANIFEST_SLICES > 1 else None,
+                query=query, size=MANIFEST_PAGE_SIZE, sort=["_shard_doc"], search_after=search_after,
+                source=["path", "hash"], track_total_hits=False, filter_path=["hits.hits._source", "hits.hits.sort"],
+            )
+            hits = response.body.get("hits", {"hits": []})["hits"]
+            if not hits:
+                return result
+            for hit in hits:
+                result[hit["_source"]["path"]] = hit["_source"]["hash"]
+            search_after = hits[-1]["sort"]
+
+    def file_manifest(self, path_prefixes):
+        state = self.manifest_state()
+        snapshot = load_manifest_snapshot(MANIFEST_SNAPSHOT_FILE)
+        if snapshot and snapshot["state"] == state:
+            logger.info(f"📸 Manifest snapshot is up to date ({state[0]} files)")
+            return {p: h for p, h in zip(snapshot["paths"], snapshot["hashes"]) if in_subtrees(p, path_prefixes)}
+        query = manifest_query(path_prefixes)
+        pit_id = self.es.open_point_in_time(index=ES_INDEX_FILE_MANIFEST, keep_alive=MANIFEST_PIT_KEEP_ALIVE)["id"]
+        with ThreadPoolExecutor(max_workers=MANIFEST_SLICES) as pool:
+            slices = list(pool.map(lambda slice_id: self.manifest_slice(pit_id, query, slice_id), range(MANIFEST_SLICES)))
+        self.es.close_point_in_time(id=pit_id)
+        result = {path: file_hash for slice_result in slices for path, file_hash in slice_result.items()}
+        if not path_prefixes:
+            save_manifest_snapshot(MANIFEST_SNAPSHOT_FILE, state, result)
+        return result
+
+    def manifest_hash(self, rel_path):
+        response = self.es.options(ignore_status=404).get(index=ES_INDEX_FILE_MANIFEST, id=rel_path, source_includes=["hash"])
+        return response["_source"]["hash"] if response["found"] else None
+
+    def text_search(self, question, path_prefix, symbols, size):
+        path_filter = [{"prefix": {"path": path_prefix}}] if path_prefix else []
+        should_clauses = [{"multi_match": {"query": question, "fields": ["text^1.0", "text.ru^1.3", "text.en^1.2"]}}]
+        if symbols:
+            should_clauses.append({"terms": {"symbols": [s.lower() for s in symbols if s]}})
+        response = self.es.search(
+            index=ES_INDEX_CHUNKS,
+            body={"size": size, "query": {"bool": {"filter": path_filter, "should": should_clauses, "minimum_should_match": 1}}, "_source": {"includes": SOURCE_FIELDS}}
+        )
+        return response["hits"]["hits"]
+
+    def vector_search(self, vector, path_prefix, size, num_candidates):
+        knn_config = {"field": "embedding", "query_vector": vector, "k": size, "num_candidates": num_candidates}
+        if path_prefix:
+            knn_config["filter"] = {"bool": {"must": [{"prefix": {"path": path_prefix}}]}}
+        response = self.es.search(index=ES_INDEX_CHUNKS, body={"size": size, "knn": knn_config, "_source": {"includes": SOURCE_FIELDS}})
+        return response["hits"]["hits"]
+
+    def get_chunks(self, doc_ids):
+        response = self.es.mget(index=ES_INDEX_CHUNKS, ids=doc_ids, source_includes=SOURCE_FIELDS)
+        return {doc["_id"]: doc["_source"] for doc in response["docs"] if doc["found"]}
+
+    def refresh(self):
+        self.es.indices.refresh(index=[ES_INDEX_CHUNKS, ES_INDEX_FILE_MANIFEST, ES_INDEX_SYMBOLS])
+
+    def close(self):
+        self.es.close()
+
+def index_terms(text):
+    terms = []
+    for word in WORD_PATTERN.findall(text):
+        terms.append(word.lower())
+        parts = [part.lower() for part in WORD_PART_PATTERN.findall(word)]
+        if len(parts) > 1:
+            terms.extend(parts)
+    return terms
+
+def unit_vector(vector):
+    array = np.asarray(vector[:EMBED_DIMS], dtype=np.float32)
+    return array / np.linalg.norm(array)
+
+class LocalStorage:
+    def __init__(self, index_dir):
+        index_dir.mkdir(parents=True, exist_ok=True)
+        self.vectors_file = index_dir / "vectors.f16"
+        self.vectors_file.touch()
+        self.vectors = None
+        self.vectors_key = None
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(index_dir / "index.sqlite", isolation_level=None, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                row_id INTEGER PRIMARY KEY,
+                id TEXT UNIQUE NOT NULL,
+                path TEXT NOT NULL,
+                vector_row INTEGER NOT NULL,
+                source TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_path ON chunks(path);
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(terms, tokenize='unicode61 remove_diacritics 2');
+            CREATE TABLE IF NOT EXISTS chunk_symbols (row_id INTEGER NOT NULL, symbol TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS chunk_symbols_symbol ON chunk_symbols(symbol);
+            CREATE INDEX IF NOT EXISTS chunk_symbols_row ON chunk_symbols(row_id);
+            CREATE TABLE IF NOT EXISTS manifest (path TEXT PRIMARY KEY, hash TEXT NOT NULL, document TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS commits (repo TEXT PRIMARY KEY, document TEXT NOT NULL);
+        """)
+        logger.info(f"💾 Local index at {index_dir}")
+
+    def vector_matrix(self):
+        stat = self.vectors_file.stat()
+        key = (stat.st_ino, stat.st_size)
+        if key != self.vectors_key:
+            rows = stat.st_size // (EMBED_DIMS * 2)
+            self.vectors = np.memmap(self.vectors_file, dtype=np.float16, mode="r", shape=(rows, EMBED_DIMS)) if rows else np.zeros((0, EMBED_DIMS), dtype=np.float16)
+            self.vectors_key = key
+        return self.vectors
+
+    def append_vectors(self, vectors):
+        matrix = np.stack([unit_vector(vector) for vector in vectors]).astype(np.float16)
+        with open(self.vectors_file, "ab") as vectors_file:
+            start_row = vectors_file.tell() // (EMBED_DIMS * 2)
+            vectors_file.write(matrix.tobytes())
+        return start_row
+
+    def delete_rows(self, where, params):
+        row_ids = [(row["row_id"],) for row in self.db.execute(f"SELECT row_id FROM chunks WHERE {where}", params)]
+        self.db.executemany("DELETE FROM chunks_fts WHERE rowid = ?", row_ids)
+        self.db.executemany("DELETE FROM chunk_symbols WHERE row_id = ?", row_ids)
+        self.db.executemany("DELETE FROM chunks WHERE row_id = ?", row_ids)
+        return len(row_ids)
+
+    def delete_file(self, rel_path):
+        with self.lock:
+            self.db.execute("BEGIN")
+            chunks_deleted = self.delete_rows("path = ?", (rel_path,))
+            manifest_deleted = self.db.execute("DELETE FROM manifest WHERE path = ?", (rel_path,)).rowcount
+            self.db.execute("COMMIT")
+        return {"chunks": chunks_deleted, "manifest": manifest_deleted, "symbols": 0}
+
+    def write_file(self, chunks, manifest):
+        with self.lock:
+            start_row = self.append_vectors([chunk["embedding"] for chunk in chunks]) if chunks else 0
+            self.db.execute("BEGIN")
+            for offset, chunk in enumerate(chunks):
+                source = {k: v for k, v in chunk.items() if not k.startswith("_") and k != "embedding"}
+                self.delete_rows("id = ?", (chunk["_id"],))
+                row_id = self.db.execute(
+                    "INSERT INTO chunks (id, path, vector_row, source) VALUES (?, ?, ?, ?)",
+                    (chunk["_id"], chunk["path"], start_row + offset, json.dumps(source, ensure_ascii=False))
+                ).lastrowid
+                self.db.execute("INSERT INTO chunks_fts (rowid, terms) VALUES (?, ?)", (row_id, " ".join(index_terms(chunk["text"]))))
+                self.db.executemany("INSERT INTO chunk_symbols (row_id, symbol) VALUES (?, ?)", [(row_id, s.lower()) for s in chunk["symbols"]])
+            document = {k: v for k, v in manifest.items() if not k.startswith("_")}
+            self.db.execute(
+                "INSERT OR REPLACE INTO manifest (path, hash, document) VALUES (?, ?, ?)",
+                (manifest["path"], manifest["hash"], json.dumps(document, ensure_ascii=False))
+            )
+            self.db.execute("COMMIT")
+
+    def file_chunks(self, rel_path):
+        with self.lock:
+            rows = self.db.execute("SELECT vector_row, source FROM chunks WHERE path = ?", (rel_path,)).fetchall()
+            matrix = self.vector_matrix()
+        return [{**json.loads(row["source"]), "embedding": matrix[row["vector_row"]].astype(np.float32).tolist()} for row in rows]
+
+    def get_commit(self, repo):
+        with self.lock:
+            row = self.db.execute("SELECT document FROM commits WHERE repo = ?", (repo,)).fetchone()
+        return json.loads(row["document"])["commit"] if row else None
+
+    def set_commit(self, repo, document):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO commits (repo, document) VALUES (?, ?)", (repo, json.dumps(document, ensure_ascii=False)))
+
+    def file_manifest(self, path_prefixes):
+        with self.lock:
+            return {row["path"]: row["hash"] for row in self.db.execute("SELECT path, hash FROM manifest") if in_subtrees(row["path"], path_prefixes)}
+
+    def manifest_hash(self, rel_path):
+        with self.lock:
+            row = self.db.execute("SELECT hash FROM manifest WHERE path = ?", (rel_path,)).fetchone()
+        return row["hash"] if row else None
+
+    def hits(self, scores):
+        ranked_ids = sorted(scores, key=scores.get, reverse=True)
+        sources = self.get_chunks(ranked_ids) if ranked_ids else {}
+        return [{"_id": doc_id, "_score": scores[doc_id], "_source": sources[doc_id]} for doc_id in ranked_ids]
+
+    def text_search(self, question, path_prefix, symbols, size):
+        match_query = " OR ".join(f'"{term}"' for term in dict.fromkeys(index_terms(question)))
+        scores = {}
+        with self.lock:
+            if match_query:
+                for row in self.db.execute("""
+                    SELECT chunks.id, -bm25(chunks_fts) AS score FROM chunks_fts JOIN chunks ON chunks.row_id = chunks_fts.rowid
+                    WHERE chunks_fts MATCH ? AND substr(chunks.path, 1, ?) = ? ORDER BY bm25(chunks_fts) LIMIT ?
+                """, (match_query, len(path_prefix), path_prefix, size)):
+                    scores[row["id"]] = row["score"]
+            symbol_names = [s.lower() for s in symbols if s] if symbols else []
+            if symbol_names:
+                for row in self.db.execute(f"""
+                    SELECT DISTINCT chunks.id FROM chunk_symbols JOIN chunks ON chunks.row_id = chunk_symbols.row_id
+                    WHERE chunk_symbols.symbol IN ({",".join("?" * len(symbol_names))}) AND substr(chunks.path, 1, ?) = ? LIMIT ?
+                """, (*symbol_names, len(path_prefix), path_prefix, size)):
+                    scores[row["id"]] = scores.get(row["id"], 0.0) + SYMBOL_MATCH_SCORE
+        top_ids = sorted(scores, key=scores.get, reverse=True)[:size]
+        return self.hits({doc_id: scores[doc_id] for doc_id in top_ids})
+
+    def vector_search(self, vector, path_prefix, size, num_candidates):
+        query = unit_vector(vector)
+        with self.lock:
+            rows = self.db.execute("SELECT id, vector_row FROM chunks WHERE substr(path, 1, ?) = ?", (len(path_prefix), path_prefix)).fetchall()
+            matrix = self.vector_matrix()
+        if not rows:
+            return []
+        vector_rows = np.fromiter((row["vector_row"] for row in rows), dtype=np.int64, count=len(rows))
+        similarities = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), VECTOR_BLOCK_ROWS):
+            block_rows = vector_rows[start:start + VECTOR_BLOCK_ROWS]
+            similarities[start:start + len(block_rows)] = matrix[block_rows].astype(np.float32) @ query
+        top = np.argpartition(-similarities, min(size, len(rows)) - 1)[:size]
+        return self.hits({rows[idx]["id"]: float(similarities[idx]) for idx in top})
+
+    def get_chunks(self, doc_ids):
+        with self.lock:
+            rows = self.db.execute(f"SELECT id, source FROM chunks WHERE id IN ({','.join('?' * len(doc_ids))})", doc_ids).fetchall()
+        return {row["id"]: {k: v for k, v in json.loads(row["source"]).items() if k in SOURCE_FIELDS} for row in rows}
+
+    def refresh(self):
+        return
+
+    def compact_vectors(self):
+        with self.lock:
+            rows = self.db.execute("SELECT row_id, vector_row FROM chunks ORDER BY vector_row").fetchall()
+            matrix = self.vector_matrix()
+            if len(matrix) <= 2 * len(rows):
+                return
+            tmp_file = self.vectors_file.with_suffix(".tmp")
+            with open(tmp_file, "wb") as vectors_file:
+                for start in range(0, len(rows), VECTOR_BLOCK_ROWS):
+                    vectors_file.write(matrix[[row["vector_row"] for row in rows[start:start + VECTOR_BLOCK_ROWS]]].tobytes())
+            self.db.execute("BEGIN")
+            self.db.executemany("UPDATE chunks SET vector_row = ? WHERE row_id = ?", [(idx, row["row_id"]) for idx, row in enumerate(rows)])
+            tmp_file.replace(self.vectors_file)
+            self.db.execute("COMMIT")
+        logger.info(f"🧹 Compacted local vectors: {len(matrix)} → {len(rows)} rows")
+
+    def close(self):
+        self.compact_vectors()
+        self.db.close()
+
+STORAGE = LocalStorage(LOCAL_INDEX_DIR) if SEARCH_BACKEND == "local" else ElasticStorage()
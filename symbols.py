@@ -0,0 +1,109 @@
+from pathlib import Path
+
+from elasticsearch import Elasticsearch, helpers
+
+from utils import ES_URL, ES_INDEX_CHUNKS, ES_INDEX_SYMBOLS, setup_logging, to_posix
+
+logger = setup_logging(Path(__file__).stem)
+
+ES = Elasticsearch(ES_URL, request_timeout=30, max_retries=3, retry_on_timeout=True)
+
+SYMBOL_FIELDS = ["symbol", "path", "chunk", "start_line", "end_line", "kind", "title", "lang"]
+USAGE_PAGE_CHUNKS = 50
+
+def symbol_actions(chunks):
+    return [
+        {
+            "_op_type": "index",
+            "_index": ES_INDEX_SYMBOLS,
+            "_id": f"{chunk['_id']}:{symbol}",
+            "name": symbol,
+            "symbol": symbol,
+            "path": chunk["path"],
+            "chunk": chunk["_id"],
+            "start_line": chunk["start_line"],
+            "end_line": chunk["end_line"],
+            "kind": chunk["kind"],
+            "title": chunk["title"],
+            "lang": chunk["lang"],
+            "updated_at": chunk["updated_at"],
+        }
+        for chunk in chunks
+        for symbol in chunk["symbols"]
+    ]
+
+def path_filter(path_prefix):
+    normalized = to_posix(path_prefix.replace("*", "")) if path_prefix else ""
+    return [{"prefix": {"path": normalized}}] if normalized else []
+
+def symbol_query(symbol, match):
+    name = symbol.lower()
+    if match == "exact":
+        return {"term": {"name": name}}
+    if match == "prefix":
+        return {"prefix": {"name": name}}
+    return {"bool": {"should": [
+        {"fuzzy": {"name": {"value": name, "fuzziness": "AUTO"}}},
+        {"match": {"name.parts": {"query": symbol, "operator": "and"}}},
+    ], "minimum_should_match": 1}}
+
+def find_definitions(symbol, match, path_prefix, limit):
+    response = ES.search(
+        index=ES_INDEX_SYMBOLS,
+        size=limit,
+        query={"bool": {"must": [symbol_query(symbol, match)], "filter": path_filter(path_prefix)}},
+        source=SYMBOL_FIELDS,
+    )
+    definitions = [hit["_source"] for hit in response["hits"]["hits"]]
+    return sorted(definitions, key=lambda d: d["symbol"].lower() not in d["title"].lower())
+
+def usage_query(symbol, path_prefix):
+    return {"bool": {
+        "must": [{"match_phrase": {"text": symbol}}],
+        "should": [{"term": {"symbols": symbol.lower()}}],
+        "filter": path_filter(path_prefix),
+    }}
+
+def find_usages(symbol, path_prefix, limit):
+    usages = []
+    search_after = None
+    while len(usages) < limit:
+        response = ES.search(
+            index=ES_INDEX_CHUNKS,
+            size=USAGE_PAGE_CHUNKS,
+            query=usage_query(symbol, path_prefix),
+            sort=[{"_score": "desc"}, {"path": "asc"}, {"chunk_id": "asc"}],
+            search_after=search_after,
+            source=["path", "start_line", "title", "text"],
+        )
+        hits = response["hits"]["hits"]
+        if not hits:
+            break
+        for hit in hits:
+            chunk = hit["_source"]
+            for offset, line in enumerate(chunk["text"].split("\n")):
+                if symbol in line:
+                    usages.append({"path": chunk["path"], "line": chunk["start_line"] + offset, "title": chunk["title"], "text": line.strip()})
+        search_after = hits[-1]["sort"]
+    return usages[:limit]
+
+def find_symbol(symbol, match, path_prefix, usages, limit):
+    result = {"definitions": find_definitions(symbol, match, path_prefix, limit)}
+    if usages:
+        result["usages"] = find_usages(symbol, path_prefix, limit)
+    logger.info(f"🔎 find_symbol {symbol} ({match}): definitions={len(result['definitions'])}, usages={len(result.get('usages', []))}")
+    return result
+
+def rebuild_symbol_index():
+    chunks = (
+        {**hit["_source"], "_id": hit["_id"]}
+        for hit in helpers.scan(ES, index=ES_INDEX_CHUNKS, query={"_source": {"excludes": ["embedding", "text"]}})
+    )
+    indexed, _ = helpers.bulk(ES.options(request_timeout=120), (a for chunk in chunks for a in symbol_actions([chunk])), chunk_size=2000)
+    logger.info(f"🔣 Rebuilt symbol index from {ES_INDEX_CHUNKS}: {indexed} symbols")
+
+def main():
+    rebuild_symbol_index()
+
+if __name__ == "__main__":
+    main()
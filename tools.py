@@ -33,12 +33,63 @@ MAIN_SEARCH_TOOL = {
                     "Может изменить порядок важных чанков, поднятых ES благодаря бустам. "
                     "Рекомендуется отключать, когда важны точные совпадения по символам или терминам."
                 )
+            },
+            "neighbors": {
+                "type": "integer",
+                "minimum": 0,
+                "maximum": 2,
+                "description": (
+                    "сколько соседних чанков того же файла добавить с каждой стороны от найденного (по умолчанию: 0). "
+                    "Соседние и смежные чанки склеиваются в один непрерывный фрагмент (span) с общим диапазоном строк — "
+                    "используй вместо дочитывания окружения через execute_command."
+                )
+            },
+            "group_by_file": {
+                "type": "boolean",
+                "description": "сгруппировать результат по файлам: у каждого файла лучший ранг, число попаданий и склеенные фрагменты (по умолчанию: false)"
             }
         },
         "required": ["question", "path_prefix", "top_n", "use_reranker"]
     }
 }
 
+FIND_SYMBOL_TOOL = {
+    "name": "find_symbol",
+    "description": (
+        "Быстрый поиск определений символа (класс, функция, константа, env-ключ) по индексу символов без эмбеддингов и reranker. "
+        "Возвращает файл, диапазон строк, kind и title блока; с usages=true — ещё и строки, где символ упоминается."
+    ),
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "symbol": {
+                "type": "string",
+                "description": "имя символа, например UserService или findByEmail"
+            },
+            "match": {
+                "type": "string",
+                "enum": ["exact", "prefix", "fuzzy"],
+                "description": "exact — точное имя (без учёта регистра), prefix — по началу имени, fuzzy — с опечатками и по частям camelCase/snake_case"
+            },
+            "path_prefix": {
+                "type": "string",
+                "description": "префикс пути для фильтрации, пустая строка — искать везде"
+            },
+            "usages": {
+                "type": "boolean",
+                "description": "искать также места использования (строки с точным вхождением имени)"
+            },
+            "limit": {
+                "type": "integer",
+                "minimum": 1,
+                "maximum": 100,
+                "description": "максимум определений и максимум строк использований"
+            }
+        },
+        "required": ["symbol", "match", "path_prefix", "usages", "limit"]
+    }
+}
+
 EXECUTE_COMMAND_TOOL = {
     "name": "execute_command",
     "description": "Выполнение любых консольных команд в изолированном контейнере для взаимодействия с исходными файлами.",
@@ -123,3 +174,22 @@ SPLIT_BLOCKS_TOOL = {
         }
     }
 }
+
+READ_RESULT_TOOL = {
+    "name": "read_result",
+    "description": (
+        "Постраничное чтение большого результата execute_command или SELECT-инструмента, "
+        "который был сокращён (в ответе есть result_id). Возвращает строки вывода или строки таблицы начиная с offset; "
+        "строка длиннее бюджета ответа читается частями по char_offset."
+    ),
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "result_id": {"type": "string", "description": "result_id из сокращённого результата"},
+            "offset": {"type": "integer", "minimum": 0, "description": "номер первой строки страницы (с 0)"},
+            "char_offset": {"type": "integer", "minimum": 0, "description": "смещение в символах внутри первой строки страницы (0 — с начала строки, иначе next_char_offset из предыдущей страницы)"},
+            "limit": {"type": "integer", "minimum": 1, "maximum": 1000, "description": "максимум строк на странице"}
+        },
+        "required": ["result_id", "offset", "char_offset", "limit"]
+    }
+}
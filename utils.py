@@ -2,7 +2,6 @@ import hashlib
 import logging
 import os
 import re
-import subprocess
 import unicodedata
 from pathlib import Path
 from io import BytesIO
@@ -24,6 +23,15 @@ def load_prompt(filepath):
 
 EMBED_MODEL = os.getenv("EMBED_MODEL", "BAAI/bge-m3")
 RERANK_MODEL = os.getenv("RERANK_MODEL", "BAAI/bge-reranker-large")
+EMBED_DIMS = int(os.getenv("EMBED_DIMS", "1024"))
+EMBED_VECTOR_DECIMALS = int(os.getenv("EMBED_VECTOR_DECIMALS", "5"))
+VECTOR_INDEX_TYPES = ("hnsw", "int8_hnsw")
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "hnsw")
+if VECTOR_INDEX_TYPE not in VECTOR_INDEX_TYPES:
+    raise ValueError(f"Неподдерживаемый VECTOR_INDEX_TYPE={VECTOR_INDEX_TYPE}: Elasticsearch 8.12 поддерживает только {', '.join(VECTOR_INDEX_TYPES)}")
+VECTOR_HNSW_M = int(os.getenv("VECTOR_HNSW_M", "32"))
+VECTOR_HNSW_EF_CONSTRUCTION = int(os.getenv("VECTOR_HNSW_EF_CONSTRUCTION", "256"))
+KNN_NUM_CANDIDATES_FACTOR = float(os.getenv("KNN_NUM_CANDIDATES_FACTOR", "4"))
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 CLAUDE_MODEL = os.getenv("CLAUDE_MODEL", "claude-3-haiku-20240307")
 
@@ -31,9 +39,73 @@ ES_HOST = os.getenv("ES_HOST", "localhost")
 ES_PORT = int(os.getenv("ES_PORT", "9200"))
 ES_INDEX_CHUNKS = os.getenv("ES_INDEX_CHUNKS", "chunks")
 ES_INDEX_FILE_MANIFEST = os.getenv("ES_INDEX_FILE_MANIFEST", "file_manifest")
+ES_INDEX_SYMBOLS = os.getenv("ES_INDEX_SYMBOLS", "symbols")
 ES_URL = f"http://{ES_HOST}:{ES_PORT}"
 
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "elasticsearch")
+LOCAL_INDEX_DIR = Path(os.getenv("LOCAL_INDEX_DIR", "cache/local_index")).resolve()
+
 SANDBOX_CONTAINER_NAME = os.getenv("SANDBOX_CONTAINER_NAME", "rag-assistant-rag-sandbox-1")
+SANDBOX_RUNNER = os.getenv("SANDBOX_RUNNER", "docker")
+SANDBOX_RUNNERS = int(os.getenv("SANDBOX_RUNNERS", "4"))
+SANDBOX_COMMAND_TIMEOUT = int(os.getenv("SANDBOX_COMMAND_TIMEOUT", "30"))
+SANDBOX_KILL_GRACE_SECONDS = int(os.getenv("SANDBOX_KILL_GRACE_SECONDS", "5"))
+SANDBOX_OUTPUT_LIMIT_BYTES = int(os.getenv("SANDBOX_OUTPUT_LIMIT_BYTES", "1000000"))
+
+RESULT_MAX_CHARS = int(os.getenv("RESULT_MAX_CHARS", "20000"))
+RESULT_MAX_TOKENS = int(os.getenv("RESULT_MAX_TOKENS", "6000"))
+RESULT_MAX_ROWS = int(os.getenv("RESULT_MAX_ROWS", "100"))
+RESULT_STORE_SIZE = int(os.getenv("RESULT_STORE_SIZE", "64"))
+DB_FETCH_BATCH = int(os.getenv("DB_FETCH_BATCH", "500"))
+DB_MAX_FETCH_ROWS = int(os.getenv("DB_MAX_FETCH_ROWS", "10000"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "2"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_MAX_CONCURRENCY = int(os.getenv("DB_MAX_CONCURRENCY", "4"))
+DB_CACHE_TTL_SECONDS = float(os.getenv("DB_CACHE_TTL_SECONDS", "60"))
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "128"))
+
+SCAN_CACHE_FILE = Path(os.getenv("SCAN_CACHE_FILE", "cache/scan_stat.json")).resolve()
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "8"))
+SCAN_GIT_OIDS = os.getenv("SCAN_GIT_OIDS", "false").lower() == "true"
+MASK_RULES_FILE = Path(os.getenv("MASK_RULES_FILE", "cache/mask_rules.sha1")).resolve()
+
+BUILD_SPLIT_MODE = os.getenv("BUILD_SPLIT_MODE", "sync")
+BUILD_SUBTREES = [p.strip().strip("/") + "/" for p in os.getenv("BUILD_SUBTREES", "").split(",") if p.strip()]
+
+MANIFEST_PAGE_SIZE = int(os.getenv("MANIFEST_PAGE_SIZE", "10000"))
+MANIFEST_SLICES = int(os.getenv("MANIFEST_SLICES", "4"))
+MANIFEST_SNAPSHOT_FILE = Path(os.getenv("MANIFEST_SNAPSHOT_FILE", "cache/manifest_snapshot.json")).resolve()
+SPLIT_BATCH_SIZE = int(os.getenv("SPLIT_BATCH_SIZE", "1000"))
+SPLIT_BATCH_POLL_SECONDS = float(os.getenv("SPLIT_BATCH_POLL_SECONDS", "30"))
+
+SPLIT_WINDOW_LINES = int(os.getenv("SPLIT_WINDOW_LINES", "600"))
+SPLIT_WINDOW_TOKENS = int(os.getenv("SPLIT_WINDOW_TOKENS", "12000"))
+SPLIT_WINDOW_OVERLAP = int(os.getenv("SPLIT_WINDOW_OVERLAP", "60"))
+SPLIT_WINDOW_WORKERS = int(os.getenv("SPLIT_WINDOW_WORKERS", "4"))
+MAX_CHUNK_LINES = int(os.getenv("MAX_CHUNK_LINES", "300"))
+MAX_CHUNK_TOKENS = int(os.getenv("MAX_CHUNK_TOKENS", "2048"))
+
+JOURNAL_FILE = Path(os.getenv("JOURNAL_FILE", "cache/build_journal.sqlite")).resolve()
+JOURNAL_MAX_ATTEMPTS = int(os.getenv("JOURNAL_MAX_ATTEMPTS", "5"))
+JOURNAL_BACKOFF_SECONDS = float(os.getenv("JOURNAL_BACKOFF_SECONDS", "30"))
+
+WATCH_DEBOUNCE_SECONDS = float(os.getenv("WATCH_DEBOUNCE_SECONDS", "2"))
+WATCH_QUEUE_SIZE = int(os.getenv("WATCH_QUEUE_SIZE", "256"))
+WATCH_WORKERS = int(os.getenv("WATCH_WORKERS", "4"))
+
+HISTORY_PAGE_MAX_TOKENS = int(os.getenv("HISTORY_PAGE_MAX_TOKENS", "3000"))
+HISTORY_RECENT_PAGES = int(os.getenv("HISTORY_RECENT_PAGES", "3"))
+HISTORY_MAX_PAGES = int(os.getenv("HISTORY_MAX_PAGES", "6"))
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "1500"))
+
+CHAT_CONCURRENCY = int(os.getenv("CHAT_CONCURRENCY", "4"))
+CHAT_QUEUE_SIZE = int(os.getenv("CHAT_QUEUE_SIZE", "64"))
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+METRICS_DIR = Path(os.getenv("METRICS_DIR", "cache/metrics")).resolve()
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+TRACE_FILE = Path(os.getenv("TRACE_FILE", "cache/traces.jsonl")).resolve()
 
 
 REPOS_ROOT = Path("repos").resolve()
@@ -79,6 +151,17 @@ def setup_logging(name: str, file: bool = True) -> logging.Logger:
     logger.propagate = False
     return logger
 
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def in_subtrees(rel_path: str, subtrees: list[str]) -> bool:
+    return not subtrees or rel_path.startswith(tuple(subtrees))
+
+def compact_vector(vector) -> list[float]:
+    return [round(value, EMBED_VECTOR_DECIMALS) for value in vector[:EMBED_DIMS]]
+
 def to_posix(p: str | Path) -> str:
     s = (str(p) or "").strip().replace("\\", "/")
     while s.startswith("./") or s.startswith("../"):
@@ -106,9 +189,9 @@ def is_ignored(rel_path: str) -> bool:
     return IGNORE_SPEC.match_file(rel_path)
 
 def git_blob_oid(path: Path) -> str:
-    data = path.read_bytes()
-    header = f"blob {len(data)}\0".encode()
-    return hashlib.sha1(header + data).hexdigest()
+    header = f"blob {path.stat().st_size}\0".encode()
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, lambda: hashlib.sha1(header)).hexdigest()
 
 def extract_binary_content(path: Path):
     with open(path, "rb") as f:
@@ -141,17 +224,3 @@ def extract_binary_content(path: Path):
         img = Image.open(BytesIO(file_bytes))
         return pytesseract.image_to_string(img, lang="rus+eng")
     return None
-
-def execute_command(command: str):
-    ps_cmd = ['docker', 'ps', '--filter', f'name={SANDBOX_CONTAINER_NAME}', '--format', '{{.ID}}']
-    ps_result = subprocess.run(ps_cmd, capture_output=True, text=True)
-    if ps_result.returncode != 0 or not ps_result.stdout.strip():
-        raise RuntimeError(f"Контейнер {SANDBOX_CONTAINER_NAME} не найден")
-    container_id = ps_result.stdout.strip()
-    exec_cmd = ['docker', 'exec', '-u', 'nobody', container_id, 'timeout', '30', 'sh', '-c', command]
-    exec_result = subprocess.run(exec_cmd, capture_output=True, text=True)
-    return {
-        "stdout": exec_result.stdout,
-        "exit_code": exec_result.returncode
-    }
-
@@ -0,0 +1,87 @@
+import queue
+import threading
+import time
+from pathlib import Path
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from utils import (
+    REPOS_ROOT,
+    WATCH_DEBOUNCE_SECONDS, WATCH_QUEUE_SIZE, WATCH_WORKERS,
+    is_ignored, setup_logging, to_posix
+)
+from mask import mask_path
+from scan import current_hash
+from build import get_manifest_hash, sync_file
+from storage import STORAGE
+from metrics import set_gauge, export_metrics
+
+logger = setup_logging(Path(__file__).stem)
+
+PENDING_LOCK = threading.Lock()
+PENDING_SINCE = {}
+ACTIVE_PATHS = set()
+CHANGE_QUEUE = queue.Queue(maxsize=WATCH_QUEUE_SIZE)
+CHANGE_EVENT_TYPES = {"created", "modified", "moved", "deleted", "closed"}
+
+class ChangeHandler(FileSystemEventHandler):
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type not in CHANGE_EVENT_TYPES:
+            return
+        now = time.monotonic()
+        for raw_path in (event.src_path, event.dest_path):
+            if not raw_path:
+                continue
+            rel_path = to_posix(Path(raw_path).relative_to(REPOS_ROOT))
+            if is_ignored(rel_path):
+                continue
+            with PENDING_LOCK:
+                PENDING_SINCE[rel_path] = now
+
+def pop_settled_paths():
+    now = time.monotonic()
+    with PENDING_LOCK:
+        settled = [p for p, since in PENDING_SINCE.items() if now - since >= WATCH_DEBOUNCE_SECONDS and p not in ACTIVE_PATHS]
+        for rel_path in settled:
+            del PENDING_SINCE[rel_path]
+            ACTIVE_PATHS.add(rel_path)
+    return settled
+
+def index_path(rel_path):
+    mask_path(rel_path)
+    sync_file(rel_path, current_hash(rel_path), get_manifest_hash(rel_path))
+    STORAGE.refresh()
+
+def index_worker():
+    while True:
+        rel_path = CHANGE_QUEUE.get()
+        t0 = time.time()
+        try:
+            index_path(rel_path)
+            logger.info(f"👁️  Synced {rel_path} in {time.time()-t0:.2f}s, queue={CHANGE_QUEUE.qsize()}")
+        except Exception as e:
+            logger.error(f"❌ Failed to sync {rel_path}: {e}")
+        with PENDING_LOCK:
+            ACTIVE_PATHS.discard(rel_path)
+        CHANGE_QUEUE.task_done()
+        set_gauge("watch_queue_depth", {}, CHANGE_QUEUE.qsize())
+        export_metrics("watch")
+
+def main():
+    logger.info(f"👀 Watching {REPOS_ROOT} (debounce={WATCH_DEBOUNCE_SECONDS}s, queue={WATCH_QUEUE_SIZE}, workers={WATCH_WORKERS})")
+    for _ in range(WATCH_WORKERS):
+        threading.Thread(target=index_worker, daemon=True).start()
+    observer = Observer()
+    observer.schedule(ChangeHandler(), str(REPOS_ROOT), recursive=True)
+    observer.start()
+    while True:
+        time.sleep(WATCH_DEBOUNCE_SECONDS / 2)
+        for rel_path in pop_settled_paths():
+            if CHANGE_QUEUE.full():
+                logger.warning(f"⏳ Queue full ({WATCH_QUEUE_SIZE}), waiting for split/index workers")
+            CHANGE_QUEUE.put(rel_path)
+            set_gauge("watch_queue_depth", {}, CHANGE_QUEUE.qsize())
+
+if __name__ == "__main__":
+    main()